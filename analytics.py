@@ -0,0 +1,123 @@
+from datetime import date
+
+ROLLING_WINDOWS = (30, 90)
+
+# The period a completion counts towards: the day, the Monday-based week, or the month
+# (as 'YYYY-MM'); julianday('0001-01-01') is 1721425.5 and date(1, 1, 1).toordinal() is 1
+PERIOD_SQL = """
+    CASE h.periodicity
+        WHEN 'D' THEN ht.marked_date
+        WHEN 'W' THEN (ht.marked_date - 1) / 7
+        ELSE strftime('%Y-%m', ht.marked_date + 1721424.5)
+    END
+"""
+
+def count_periods(periodicity, start, end):
+    """
+    Count the periods from one day to another, both included.
+
+    Parameters:
+    periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+    start (int): The first day, as a day ordinal.
+    end (int): The last day, as a day ordinal.
+
+    Returns:
+    int: The number of periods, or 0 if start is after end.
+    """
+    if start > end:
+        return 0
+    if periodicity == 'D':
+        return end - start + 1
+    if periodicity == 'W':
+        return (end - 1) // 7 - (start - 1) // 7 + 1
+    first, last = date.fromordinal(start), date.fromordinal(end)
+    return (last.year - first.year) * 12 + last.month - first.month + 1
+
+def _rate(completed, periods):
+    """
+    Get a completion rate.
+
+    Parameters:
+    completed (int): The number of completed periods.
+    periods (int): The number of periods.
+
+    Returns:
+    float: The rate, rounded to 4 digits, or None if there were no periods.
+    """
+    return round(completed / periods, 4) if periods else None
+
+def compute_analytics(cur, habit_id=None, today=None):
+    """
+    Compute the analytics of one habit, or of all habits together, with two aggregate queries.
+
+    A period counts as completed if the habit was marked at least once in it, between the day the
+    habit became active (its creation, or its first completion if that is earlier) and today. The
+    rolling rates only count the periods overlapping the last 30 and 90 days, and the weekday and
+    month counts the completions up to today, so all of them cover the same history.
+
+    Parameters:
+    cur (sqlite3.Cursor): The cursor the queries run on.
+    habit_id (str): The ID of the habit, or None for all habits.
+    today (int): Today, as a day ordinal.
+
+    Returns:
+    dict: The 'completion_rate' since the habit became active, the 'rolling_30_days' and 'rolling_90_days'
+    rates, the 'weekdays' completion counts (Monday first) and the 'months' completion counts,
+    as [{'month': 'YYYY-MM', 'completions': count}] in month order.
+    """
+    today = today or date.today().toordinal()
+    where, params = ('WHERE h.id = ?', [habit_id]) if habit_id is not None else ('', [])
+    windows = [today - days + 1 for days in ROLLING_WINDOWS]
+    cur.execute(
+        f"""
+        SELECT
+            h.periodicity,
+            h.active_since,
+            COUNT(DISTINCT {PERIOD_SQL}),
+            {', '.join(f'COUNT(DISTINCT CASE WHEN ht.marked_date >= ? THEN {PERIOD_SQL} END)' for _ in windows)}
+        FROM
+            habits h
+        LEFT JOIN
+            habit_tracking ht ON ht.habit_id = h.id AND ht.marked_date BETWEEN h.active_since AND ?
+        {where}
+        GROUP BY
+            h.id
+        """,
+        (*windows, today, *params)
+    )
+    periods, completed = [0] * (len(windows) + 1), [0] * (len(windows) + 1)
+    for periodicity, active_since, *counts in cur.fetchall():
+        starts = [active_since] + [max(active_since, start) for start in windows]
+        for i, (start, count) in enumerate(zip(starts, counts)):
+            periods[i] += count_periods(periodicity, start, today)
+            completed[i] += count
+    # all habits together read the daily rollup instead of the whole tracking history
+    if habit_id is None:
+        source, day, count = 'daily_rollup WHERE day <= ?', 'day', 'SUM(completions)'
+    else:
+        source, day, count = 'habit_tracking WHERE marked_date <= ? AND habit_id = ?', 'marked_date', 'COUNT(*)'
+    cur.execute(
+        f"""
+        SELECT
+            strftime('%Y-%m', {day} + 1721424.5) AS month,
+            ({day} - 1) % 7 AS weekday,
+            {count}
+        FROM
+            {source}
+        GROUP BY
+            month, weekday
+        ORDER BY
+            month
+        """,
+        (today, *params)
+    )
+    weekdays, months = [0] * 7, {}
+    for month, weekday, count in cur.fetchall():
+        weekdays[weekday] += count
+        months[month] = months.get(month, 0) + count
+    analytics = {'completion_rate': _rate(completed[0], periods[0])}
+    for days, done, total in zip(ROLLING_WINDOWS, completed[1:], periods[1:]):
+        analytics[f'rolling_{days}_days'] = _rate(done, total)
+    analytics['weekdays'] = weekdays
+    analytics['months'] = [{'month': month, 'completions': count} for month, count in months.items()]
+    return analytics
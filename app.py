@@ -1,39 +1,293 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, make_response, render_template
 from habit import Habit
-from db import Database
-from datetime import datetime
-from functions_helper import date_check_with_periodicity, create_initial_habits, generate_tracking_data_dict
+from records import habits_to_json
+from repository import HabitRepository
+from db import AppDatabases, ShardManager, acquire_current_database, current_database, set_current_user, use_app_databases
+from metrics import init_metrics
+from serialization import FastJSONProvider, wants_msgpack
+from backup import ImportFailed, export_csv, export_ndjson, import_records, parse_csv, parse_ndjson
+from datetime import date, datetime
+from functions_helper import date_check_with_periodicity, bulk_date_check_with_periodicity, create_initial_habits, generate_tracking_data_dict, generate_tracking_bitmaps, encode_tracking_bitset
 import uuid
+import functools
+import inspect
+import io
+import os
 
-app = Flask(__name__)
+bp = Blueprint('habits', __name__, cli_group=None)
 
-db = Database()
+db = current_database
 
-@app.route('/')
+@bp.before_app_request
+def select_user_shard():
+    """
+    Point the request at the shard of the user named by the X-User-Id header.
+
+    Without the header, or when sharding is disabled, the request uses the shared database. Apps
+    made by create_app with their own database file use it instead of the process-wide one.
+    """
+    use_app_databases(current_app.extensions.get('habits_databases'))
+    try:
+        set_current_user(request.headers.get('X-User-Id'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+@bp.teardown_app_request
+def release_user_shard(exception=None):
+    """
+    Release the shard of the request, so it can be closed once evicted.
+
+    Streamed responses take their own hold on the shard, released when the stream is closed.
+    """
+    set_current_user(None)
+    use_app_databases(None)
+
+completion_writer = None
+
+@bp.before_app_request
+def flush_pending_completions():
+    """Commit queued completions before any other request, so it sees a consistent view of them."""
+    writer = get_completion_writer()
+    if writer is not None and request.endpoint != 'habits.mark_habit_as_completed':
+        writer.flush()
+
+def get_completion_writer():
+    """
+    Get the write-behind writer of the current app.
+
+    Returns:
+    CompletionWriter: The app's own writer, else the one set with configure_write_behind, or None.
+    """
+    return current_app.extensions.get('habits_completion_writer') or completion_writer
+
+def configure_write_behind(durability='immediate', max_batch=256, max_delay=0.01):
+    """
+    Queue completions marked through PUT /habits/<name> and commit them in grouped transactions.
+
+    Parameters:
+    durability (str): 'immediate' to respond once the completion is committed, 'grouped' to respond
+    once it is queued, or None to commit every completion on its own again.
+    max_batch (int): The maximum number of completions written per transaction.
+    max_delay (float): The longest a completion waits for others to join its transaction, in seconds.
+
+    Returns:
+    CompletionWriter: The new writer, or None if write-behind was disabled.
+    """
+    from write_behind import CompletionWriter
+    global completion_writer
+    if completion_writer is not None:
+        completion_writer.close()
+    completion_writer = CompletionWriter(durability, max_batch, max_delay) if durability is not None else None
+    return completion_writer
+
+def conditional(view=None, daily=False):
+    """
+    Tag responses with the data version and answer matching If-None-Match requests with 304.
+
+    The data version is read before the view runs, so a 304 never touches the query path and
+    a response is never tagged with a version newer than its data. Works on sync and async views.
+    Use as @conditional, or as @conditional(daily=True) on views whose output also changes with
+    the date (statuses, streaks expiring, rolling rates), so their versions change at midnight.
+    """
+    if view is None:
+        return functools.partial(conditional, daily=daily)
+
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            version = _response_version(daily)
+            if request.if_none_match.contains(version):
+                return _tag_response(Response(status=304), version)
+            return _tag_response(make_response(await view(*args, **kwargs)), version)
+        async_wrapper.daily = daily
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = _response_version(daily)
+        if request.if_none_match.contains(version):
+            return _tag_response(Response(status=304), version)
+        return _tag_response(make_response(view(*args, **kwargs)), version)
+    wrapper.daily = daily
+    return wrapper
+
+def _response_version(daily=False):
+    """
+    Get the version the response to the current request is tagged with.
+
+    JSON and MessagePack representations of the same data get different versions, so a cached
+    copy of one is never revalidated as the other.
+
+    Parameters:
+    daily (bool): Whether to include today's date in the version.
+
+    Returns:
+    str: The data version, with the date if daily and suffixed for MessagePack.
+    """
+    version = db.get_data_version()
+    if daily:
+        version = f'{version}-{date.today().isoformat()}'
+    return f'{version}-msgpack' if wants_msgpack() else version
+
+def _tag_response(response, version):
+    """
+    Set the ETag and caching headers of a successful or 304 response.
+
+    Parameters:
+    response (Response): The response.
+    version (str): The data version the response was built from.
+
+    Returns:
+    Response: The response.
+    """
+    if response.status_code in (200, 304):
+        response.set_etag(version)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('X-User-Id')
+    return response
+
+@bp.route('/')
 def index():
     """Render the index page."""
     return render_template('index.html')
 
-@app.route('/create_initial_habits', methods=['POST'])
+@bp.route('/create_initial_habits', methods=['POST'])
 def create_initial_habits_route():
     """Create initial habits from predefined data."""
     create_initial_habits()
     return jsonify({'status': 'success'})
 
-@app.route('/clear_habits_table', methods=['POST'])
+@bp.route('/clear_habits_table', methods=['POST'])
 def clear_habits_table_route():
     """Clear the habits table."""
     db.clear_habits_table()
     return jsonify({'status': 'success'})
 
-@app.route('/habits', methods=['GET'])
+@bp.route('/export', methods=['GET'])
+def export_route():
+    """
+    Stream every habit and tracking row.
+
+    Query parameters:
+    format (str): "csv" for CSV, otherwise NDJSON.
+
+    Returns:
+    Response: The streamed backup.
+    """
+    database, release = acquire_current_database()
+    if request.args.get('format') == 'csv':
+        response = Response(export_csv(database), mimetype='text/csv')
+    else:
+        response = Response(export_ndjson(database), mimetype='application/x-ndjson')
+    response.call_on_close(release)
+    return response
+
+@bp.route('/import', methods=['POST'])
+def import_route():
+    """
+    Import a backup from the request body, parsed and written a batch at a time.
+
+    Query parameters:
+    format (str): "csv" for CSV, otherwise NDJSON.
+
+    Returns:
+    JSON: The number of habits and tracking rows imported and of habits and tracking rows skipped.
+        A malformed record returns 400 with the counts the batches before it committed in "imported".
+    """
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    records = parse_csv(lines) if request.args.get('format') == 'csv' else parse_ndjson(lines)
+    try:
+        counts = import_records(db, records)
+    except ImportFailed as e:
+        return jsonify({'message': f'Invalid backup: {e}', 'imported': e.counts}), 400
+    return jsonify(counts)
+
+@bp.route('/habits', methods=['GET'])
+@conditional(daily=True)
 def get_habits():
-    """Get all habits from the database."""
-    habit = Habit()
-    habits = habit.get_all_habits()
-    return jsonify(habits)
+    """
+    Get all habits from the database.
+
+    Query parameters:
+    include_status (str): If "true", append the marked status of each habit to its row.
+    periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+    after (str): Only return habits whose ID sorts after this one.
+    limit (int): The maximum number of habits to return. When the page is full, the
+        X-Next-After header holds the value of `after` for the next page.
+    format (str): "ndjson" to stream one habit per line instead of a JSON list.
+
+    Returns:
+    JSON: The list of habits.
+    """
+    args = _habits_query_args()
+    if isinstance(args, tuple):
+        return args
+    if request.args.get('format') == 'ndjson':
+        # the stream outlives the request, so it keeps its own hold on the user's shard
+        database, release = acquire_current_database()
+        repository = HabitRepository(database)
+        dumps = current_app.json.dumps
+        def generate():
+            for batch in repository.iter_habit_batches(args['periodicity'], args['after'], args['limit']):
+                yield ''.join(dumps(row) + '\n' for row in _serialize_habits(batch, args['include_status']))
+        response = Response(generate(), mimetype='application/x-ndjson')
+        response.call_on_close(release)
+        return response
+    habits = HabitRepository(db).get_habits(args['periodicity'], args['after'], args['limit'])
+    return _habits_response(habits, args)
+
+def _habits_query_args():
+    """
+    Parse the query parameters of GET /habits.
+
+    Returns:
+    dict: The periodicity, after, limit and include_status arguments, or an error response tuple.
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) == 0:
+            return jsonify({'message': 'limit must be a positive integer'}), 400
+        limit = int(limit)
+    return {
+        'periodicity': request.args.get('periodicity') or None,
+        'after': request.args.get('after') or None,
+        'limit': limit,
+        'include_status': request.args.get('include_status', '').lower() == 'true',
+    }
+
+def _serialize_habits(habits, include_status):
+    """
+    Serialize habit records, appending the marked status of each if requested.
+
+    Parameters:
+    habits (list): The HabitRecord objects.
+    include_status (bool): Whether to append the status.
+
+    Returns:
+    list: The habit rows.
+    """
+    if not include_status:
+        return habits_to_json(habits)
+    return habits_to_json(habits, bulk_date_check_with_periodicity([(habit.periodicity, habit.last_updated_at) for habit in habits]))
+
+def _habits_response(habits, args):
+    """
+    Build the JSON response of GET /habits.
 
-@app.route('/habits/<string:name>', methods=['GET'])
+    Parameters:
+    habits (list): The HabitRecord objects.
+    args (dict): The parsed query parameters.
+
+    Returns:
+    Response: The list of habits, with X-Next-After set when the page is full.
+    """
+    response = jsonify(_serialize_habits(habits, args['include_status']))
+    if args['limit'] is not None and len(habits) == args['limit']:
+        response.headers['X-Next-After'] = habits[-1].id
+    return response
+
+@bp.route('/habits/<string:name>', methods=['GET'])
+@conditional
 def get_habit(name):
     """
     Get a habit by name.
@@ -44,11 +298,40 @@ def get_habit(name):
     Returns:
     JSON: The habit data.
     """
-    habit = Habit(name=name)
-    habit = habit.get_habit_from_name()
-    return jsonify(habit)
+    habit = HabitRepository(db).get_habit(name)
+    return jsonify(habit.to_json() if habit is not None else None)
+
+@bp.route('/habits/analytics', methods=['GET'])
+@conditional(daily=True)
+def get_all_habits_analytics():
+    """
+    Get the analytics of all habits together.
 
-@app.route('/habits', methods=['POST'])
+    Returns:
+    JSON: The completion rates since the habit became active and over the last 30 and 90 days, the completions
+    per weekday (Monday first) and the completions per month.
+    """
+    return jsonify(db.get_analytics())
+
+@bp.route('/habits/<string:name>/analytics', methods=['GET'])
+@conditional(daily=True)
+def get_habit_analytics(name):
+    """
+    Get the analytics of a habit.
+
+    Parameters:
+    name (str): The name of the habit.
+
+    Returns:
+    JSON: The completion rates since the habits became active and over the last 30 and 90 days, the completions
+    per weekday (Monday first) and the completions per month.
+    """
+    analytics = db.get_analytics(name)
+    if analytics is None:
+        return jsonify({'message': f'Habit {name} not found'}), 404
+    return jsonify(analytics)
+
+@bp.route('/habits', methods=['POST'])
 def create_habit():
     """
     Create a new habit.
@@ -75,7 +358,7 @@ def create_habit():
     else:
         return jsonify({'message': 'Habit already exists'}), 400
 
-@app.route('/habits/<string:name>', methods=['DELETE'])
+@bp.route('/habits/<string:name>', methods=['DELETE'])
 def delete_habit(name):
     """
     Delete a habit by name.
@@ -91,7 +374,7 @@ def delete_habit(name):
     habit.delete_habit()
     return jsonify({'message': f'Habit {name} deleted successfully'})
 
-@app.route('/habits/<string:name>', methods=['PUT'])
+@bp.route('/habits/<string:name>', methods=['PUT'])
 def mark_habit_as_completed(name):
     """
     Mark a habit as completed.
@@ -103,11 +386,55 @@ def mark_habit_as_completed(name):
     JSON: Success message.
     """
     habit = Habit(name=name)
-    habit.get_habit_from_name()
-    habit.mark_habit_as_completed()
+    found = habit.get_habit_from_name() is not None
+    writer = get_completion_writer()
+    if writer is None:
+        habit.mark_habit_as_completed()
+    elif not found:
+        return jsonify({'message': f'Habit {name} not found'}), 404
+    else:
+        writer.submit(habit.habit_id, date.today())
     return jsonify({'message': f'Habit {name} marked as completed'})
 
-@app.route('/habits/check/', methods=['GET'])
+@bp.route('/habits/completions', methods=['POST'])
+def mark_habits_as_completed():
+    """
+    Mark many habits as completed, optionally on past dates, in a single transaction.
+
+    The JSON body holds a "completions" list. Each entry names a habit by "id" or "name" and may
+    list "dates" ('YYYY-MM-DD' or ISO timestamps); without dates the habit is marked for today.
+
+    Returns:
+    JSON: The number of habits marked and their new streaks, keyed by habit ID.
+    """
+    body = request.json or {}
+    entries = body.get('completions', []) if isinstance(body, dict) else None
+    if not isinstance(entries, list):
+        return jsonify({'message': 'Invalid completions: expected a list of objects'}), 400
+    completions = {}
+    for entry in entries:
+        identifier = (entry.get('id') or entry.get('name')) if isinstance(entry, dict) else None
+        if not isinstance(identifier, str):
+            return jsonify({'message': f'Invalid completion entry: {entry!r}'}), 400
+        if entry.get('id'):
+            habit = Habit(habit_id=identifier)
+            found = db.habit_id_exists(habit.habit_id)
+        else:
+            habit = Habit(name=identifier)
+            found = habit.get_habit_from_name() is not None
+        if not found:
+            return jsonify({'message': f'Habit {identifier!r} not found'}), 404
+        try:
+            dates = [datetime.fromisoformat(value).date() for value in entry.get('dates') or [datetime.now().isoformat()]]
+        except (TypeError, ValueError):
+            return jsonify({'message': f'Invalid dates for habit {habit.name or habit.habit_id}'}), 400
+        completions.setdefault(habit.habit_id, []).extend(dates)
+    if not completions:
+        return jsonify({'message': 'No completions given'}), 400
+    streaks = Habit().mark_habits_as_completed(completions)
+    return jsonify({'message': f'Marked {len(streaks)} habits as completed', 'streaks': streaks})
+
+@bp.route('/habits/check/', methods=['GET'])
 def update_marked_status():
     """
     Check the marked status of a habit.
@@ -120,7 +447,8 @@ def update_marked_status():
     status = date_check_with_periodicity(periodicity, last_updated_at)
     return jsonify(status)
 
-@app.route('/habits/tracking/<string:habit_id>', methods=['GET'])
+@bp.route('/habits/tracking/<string:habit_id>', methods=['GET'])
+@conditional
 def get_habit_tracking(habit_id):
     """
     Get tracking data for a habit.
@@ -128,15 +456,93 @@ def get_habit_tracking(habit_id):
     Parameters:
     habit_id (str): The ID of the habit.
 
+    Query parameters:
+    format (str): "bitset" for one base64 bitset per year instead of lists of 0/1 values.
+    from (str): Only include dates on or after this day ('YYYY-MM-DD').
+    to (str): Only include dates on or before this day ('YYYY-MM-DD').
+    year (int): Only include dates in this year, instead of from/to.
+
     Returns:
     JSON: The tracking data.
     """
+    date_range = _tracking_date_range()
+    if date_range is None:
+        return jsonify({'message': 'Invalid date range'}), 400
     habit = Habit(habit_id=habit_id)
-    tracking_data, periodicity = habit.get_tracking_data()
-    tracking_data = generate_tracking_data_dict(tracking_data, periodicity)
-    return jsonify(tracking_data)
+    tracking_data, periodicity = habit.get_tracking_data(*date_range)
+    return _tracking_response(tracking_data, periodicity)
+
+def _tracking_date_range():
+    """
+    Parse the from/to/year query parameters of the tracking and rollup endpoints.
+
+    Returns:
+    tuple: The (start, end) dates, either of which may be None, or None if a parameter is invalid.
+    """
+    try:
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+        if request.args.get('year'):
+            year = int(request.args['year'])
+            start, end = date(year, 1, 1), date(year, 12, 31)
+    except ValueError:
+        return None
+    return start, end
+
+def _tracking_response(tracking_data, periodicity):
+    """
+    Build the response of the tracking endpoint in the requested format.
+
+    Parameters:
+    tracking_data (list): The tracking dates.
+    periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+
+    Returns:
+    Response: The tracking data.
+    """
+    if request.args.get('format') == 'bitset':
+        return jsonify(encode_tracking_bitset(generate_tracking_bitmaps(tracking_data, periodicity)))
+    return jsonify(generate_tracking_data_dict(tracking_data, periodicity))
+
+@bp.route('/rollup', methods=['GET'])
+@conditional
+def get_daily_rollup():
+    """
+    Get the completions per day and periodicity from the daily rollup.
+
+    Query parameters:
+    periodicity (str): Only include this periodicity ('D', 'W', 'M').
+    from (str): Only include days on or after this one ('YYYY-MM-DD').
+    to (str): Only include days on or before this one ('YYYY-MM-DD').
+    year (int): Only include days in this year, instead of from/to.
+
+    Returns:
+    JSON: Rows of [day, periodicity, completions, habits of the periodicity active that day], in day order.
+    """
+    date_range = _tracking_date_range()
+    if date_range is None:
+        return jsonify({'message': 'Invalid date range'}), 400
+    return jsonify(db.get_daily_rollup(*date_range, periodicity=request.args.get('periodicity')))
+
+@bp.cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """Regenerate the daily rollup from the tracking history."""
+    use_app_databases(current_app.extensions.get('habits_databases'))
+    print(f'Rebuilt the daily rollup: {db.rebuild_daily_rollup()} rows')
+
+@bp.route('/streaks', methods=['GET'])
+@conditional
+def get_streak_summary():
+    """
+    Get the longest daily, weekly, monthly and overall streaks in one response.
 
-@app.route('/streaks/daily', methods=['GET'])
+    Returns:
+    JSON: The streak summary.
+    """
+    return jsonify(db.get_streak_summary())
+
+@bp.route('/streaks/daily', methods=['GET'])
+@conditional
 def get_longest_daily_streak():
     """
     Get the longest daily streak.
@@ -148,7 +554,8 @@ def get_longest_daily_streak():
     streak = habit.longest_daily_streak()
     return jsonify(streak)
 
-@app.route('/streaks/weekly', methods=['GET'])
+@bp.route('/streaks/weekly', methods=['GET'])
+@conditional
 def get_longest_weekly_streak():
     """
     Get the longest weekly streak.
@@ -160,7 +567,8 @@ def get_longest_weekly_streak():
     streak = habit.longest_weekly_streak()
     return jsonify(streak)
 
-@app.route('/streaks/monthly', methods=['GET'])
+@bp.route('/streaks/monthly', methods=['GET'])
+@conditional
 def get_longest_monthly_streak():
     """
     Get the longest monthly streak.
@@ -172,7 +580,8 @@ def get_longest_monthly_streak():
     streak = habit.longest_monthly_streak()
     return jsonify(streak)
 
-@app.route('/streaks/longest', methods=['GET'])
+@bp.route('/streaks/longest', methods=['GET'])
+@conditional
 def get_longest_streak():
     """
     Get the longest streak.
@@ -181,4 +590,100 @@ def get_longest_streak():
     JSON: The longest streak.
     """
     name, date, streak = db.get_longest_active_streak()
-    return jsonify({'habit': name, 'date': date, 'streak': streak})
\ No newline at end of file
+    return jsonify({'habit': name, 'date': date, 'streak': streak})
+
+def enable_async_mode(app, max_workers=4):
+    """
+    Serve the read-heavy endpoints with async views whose queries run on a bounded executor.
+
+    Experimental. Replaces the views of GET /habits, /habits/tracking/<id> and /streaks*.
+    Flask runs async views under WSGI through asgiref, with an event loop per request, so every
+    request still holds a server thread and the executor adds a hop: this bounds the concurrent
+    queries but does not serve more requests at once. Requires Flask's async extra (asgiref),
+    which is not in requirements.txt. NDJSON listings are still streamed by the sync view.
+
+    Parameters:
+    app (Flask): The app whose views are replaced.
+    max_workers (int): The number of queries that may run at once.
+
+    Returns:
+    AsyncHabitStore: The store the async views query through.
+    """
+    from async_store import AsyncHabitStore
+    store = AsyncHabitStore(db, max_workers)
+
+    async def get_habits():
+        if request.args.get('format') == 'ndjson':
+            return sync_views['get_habits']()
+        args = _habits_query_args()
+        if isinstance(args, tuple):
+            return args
+        habits = await store.get_all_habits(args['periodicity'], args['after'], args['limit'])
+        return _habits_response(habits, args)
+
+    async def get_habit_tracking(habit_id):
+        date_range = _tracking_date_range()
+        if date_range is None:
+            return jsonify({'message': 'Invalid date range'}), 400
+        tracking_data, periodicity = await store.get_tracking_data(habit_id, *date_range)
+        return _tracking_response(tracking_data, periodicity)
+
+    async def get_streak_summary():
+        return jsonify(await store.get_streak_summary())
+
+    async def get_longest_daily_streak():
+        return jsonify(await store.get_longest_streak('D'))
+
+    async def get_longest_weekly_streak():
+        return jsonify(await store.get_longest_streak('W'))
+
+    async def get_longest_monthly_streak():
+        return jsonify(await store.get_longest_streak('M'))
+
+    async def get_longest_streak():
+        name, date, streak = await store.get_longest_active_streak()
+        return jsonify({'habit': name, 'date': date, 'streak': streak})
+
+    async_views = [get_habits, get_habit_tracking, get_streak_summary, get_longest_daily_streak,
+                   get_longest_weekly_streak, get_longest_monthly_streak, get_longest_streak]
+    sync_views = {view.__name__: app.view_functions[f'{bp.name}.{view.__name__}'] for view in async_views}
+    for view in async_views:
+        view.__doc__ = sync_views[view.__name__].__doc__
+        daily = getattr(sync_views[view.__name__], 'daily', False)
+        app.view_functions[f'{bp.name}.{view.__name__}'] = conditional(view, daily=daily)
+    return store
+
+def create_app(db_path=None):
+    """
+    Create the app, configured from the HABITS_* environment variables.
+
+    The database is opened, and its schema migrated, on first use rather than here. The database file,
+    shards and write-behind writer belong to the app (in app.extensions), so creating another app
+    never changes the ones of apps created before.
+
+    Parameters:
+    db_path (str): The SQLite database file, or None for the process-wide database, set with
+    configure_database and defaulting to HABITS_DB_PATH, then habits.db.
+
+    Returns:
+    Flask: The app.
+    """
+    from write_behind import CompletionWriter
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    shards = None
+    if os.environ.get('HABITS_SHARD_DIR'):
+        shards = ShardManager(os.environ['HABITS_SHARD_DIR'], int(os.environ.get('HABITS_MAX_OPEN_SHARDS', 128)))
+    app.config['HABITS_DB_PATH'] = db_path
+    app.extensions['habits_databases'] = AppDatabases(db_path, shards)
+    init_metrics(app, db)
+    app.register_blueprint(bp)
+    if os.environ.get('HABITS_WRITE_BEHIND'):
+        app.extensions['habits_completion_writer'] = CompletionWriter(
+            os.environ['HABITS_WRITE_BEHIND'], int(os.environ.get('HABITS_WRITE_BEHIND_BATCH', 256)),
+            int(os.environ.get('HABITS_WRITE_BEHIND_DELAY_MS', 10)) / 1000)
+    if os.environ.get('HABITS_ASYNC_MODE') == '1':
+        app.extensions['habits_async_store'] = enable_async_mode(app, int(os.environ.get('HABITS_ASYNC_WORKERS', 4)))
+    return app
+
+app = create_app()
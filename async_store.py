@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from habit import Habit
+from repository import HabitRepository
+
+class AsyncHabitStore:
+    """
+    An async facade over Database and Habit that runs every query on a bounded executor.
+
+    Coroutines awaiting the store never block the event loop, and at most max_workers
+    queries (and pooled connections) are in flight at once, however many requests wait.
+    Experimental: the only caller is enable_async_mode, whose views still run under WSGI.
+    Methods:
+        get_all_habits: Get habits, optionally filtered and paginated.
+        get_tracking_data: Get the tracking data of a habit.
+        get_streak_summary: Get all longest streaks.
+        get_longest_streak: Get the longest streak of a periodicity.
+        get_longest_active_streak: Get the longest active streak.
+        shutdown: Stop the executor.
+    """
+
+    def __init__(self, database, max_workers=4):
+        """
+        Initialize the store.
+
+        Parameters:
+        database (Database): The database queries run against.
+        max_workers (int): The number of executor threads, and so of concurrent queries.
+        """
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='habits-db')
+
+    async def _run(self, function, *args):
+        """
+        Run a blocking function on the executor.
+
+        The caller's context variables are copied, so per-request instrumentation follows the query.
+
+        Parameters:
+        function (callable): The function to run.
+        args: The arguments of the function.
+
+        Returns:
+        The result of the function.
+        """
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, function, *args))
+
+    def _query(self, name, *args):
+        """
+        Call a method of the database, looked up when the executor runs it.
+
+        Looking it up there rather than on the event loop keeps the opening and migrating of a
+        database on first use off the loop.
+
+        Parameters:
+        name (str): The name of the Database method.
+        args: The arguments of the method.
+
+        Returns:
+        The result of the method.
+        """
+        return getattr(self.database, name)(*args)
+
+    async def get_all_habits(self, periodicity=None, after=None, limit=None):
+        """
+        Get habits, optionally filtered and paginated.
+
+        Parameters:
+        periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+        after (str): Only return habits whose ID sorts after this one.
+        limit (int): The maximum number of habits to return.
+
+        Returns:
+        list: The HabitRecord objects.
+        """
+        return await self._run(HabitRepository(self.database).get_habits, periodicity, after, limit)
+
+    async def get_tracking_data(self, habit_id, start=None, end=None):
+        """
+        Get the tracking data of a habit.
+
+        Parameters:
+        habit_id (str): The ID of the habit.
+        start (date): Only return dates on or after this day.
+        end (date): Only return dates on or before this day.
+
+        Returns:
+        tuple: The tracking dates and periodicity.
+        """
+        return await self._run(Habit(habit_id=habit_id).get_tracking_data, start, end)
+
+    async def get_streak_summary(self):
+        """
+        Get all longest streaks.
+
+        Returns:
+        dict: The streak summary.
+        """
+        return await self._run(self._query, 'get_streak_summary')
+
+    async def get_longest_streak(self, periodicity):
+        """
+        Get the longest streak of a periodicity.
+
+        Parameters:
+        periodicity (str): The periodicity of the habits ('D', 'W', 'M').
+
+        Returns:
+        list: The longest streak.
+        """
+        return await self._run(Habit()._longest_streak, periodicity)
+
+    async def get_longest_active_streak(self):
+        """
+        Get the longest active streak.
+
+        Returns:
+        tuple: The habit name, streak start date and streak.
+        """
+        return await self._run(self._query, 'get_longest_active_streak')
+
+    def shutdown(self):
+        """Stop the executor, waiting for running queries."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,235 @@
+"""
+Streaming export and import of habits and their tracking history.
+
+Both directions work a batch at a time, so backups of any size run in constant memory.
+Records are either habits or tracking rows:
+
+    {"record": "habit", "id": "...", "name": "Read", "periodicity": "D", "created_at": "2024-01-01",
+     "streak": 3, "last_updated_at": "2024-01-03", "streak_started_at": "2024-01-01"}
+    {"record": "tracking", "id": "...", "date": "2024-01-02"}
+
+In CSV every record is a row with the columns of CSV_COLUMNS.
+
+Usage:
+    python backup.py export habits.ndjson
+    python backup.py import habits.csv
+"""
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+from datetime import date
+from db import get_database, normalize_name, ordinal_to_iso
+from repository import HabitRepository
+
+PERIODICITIES = ('D', 'W', 'M')
+
+CSV_COLUMNS = ['record', 'id', 'name', 'periodicity', 'created_at', 'streak', 'last_updated_at', 'streak_started_at', 'date']
+
+def iter_records(database, batch_size=1000):
+    """
+    Iterate over every habit, then every tracking row, reading the cursors a batch at a time.
+
+    Parameters:
+    database (Database): The database to export.
+    batch_size (int): The number of rows fetched from a cursor at once.
+
+    Yields:
+    list: The next batch of records, as dicts.
+    """
+    repository = HabitRepository(database)
+    for habits in repository.iter_habit_batches(batch_size=batch_size):
+        yield [{
+            'record': 'habit', 'id': habit.id, 'name': habit.name, 'periodicity': habit.periodicity,
+            'created_at': ordinal_to_iso(habit.created_at), 'streak': habit.streak,
+            'last_updated_at': ordinal_to_iso(habit.last_updated_at), 'streak_started_at': ordinal_to_iso(habit.streak_started_at),
+        } for habit in habits]
+    for tracking in repository.iter_tracking(batch_size):
+        yield [{'record': 'tracking', 'id': row.habit_id, 'date': ordinal_to_iso(row.marked_date)} for row in tracking]
+
+def export_ndjson(database, batch_size=1000):
+    """
+    Export the database as NDJSON, one record per line.
+
+    Parameters:
+    database (Database): The database to export.
+    batch_size (int): The number of records per yielded chunk.
+
+    Yields:
+    str: The next chunk of lines.
+    """
+    for batch in iter_records(database, batch_size):
+        yield ''.join(json.dumps(record) + '\n' for record in batch)
+
+def export_csv(database, batch_size=1000):
+    """
+    Export the database as CSV with a header row.
+
+    Parameters:
+    database (Database): The database to export.
+    batch_size (int): The number of records per yielded chunk.
+
+    Yields:
+    str: The next chunk of lines.
+    """
+    yield ','.join(CSV_COLUMNS) + '\r\n'
+    for batch in iter_records(database, batch_size):
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, CSV_COLUMNS).writerows(batch)
+        yield buffer.getvalue()
+
+def parse_ndjson(lines):
+    """
+    Parse NDJSON records one line at a time.
+
+    Parameters:
+    lines (iterable): The lines of the file.
+
+    Yields:
+    dict: The next record.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def parse_csv(lines):
+    """
+    Parse CSV records one row at a time.
+
+    Parameters:
+    lines (iterable): The lines of the file, starting with the header row.
+
+    Yields:
+    dict: The next record.
+    """
+    yield from csv.DictReader(lines)
+
+def _ordinal(value):
+    """
+    Convert an exported ISO date to a day ordinal.
+
+    Parameters:
+    value (str): The date, or None/'' for no date.
+
+    Returns:
+    int: The day ordinal, or None.
+    """
+    return date.fromisoformat(value[:10]).toordinal() if value else None
+
+class ImportFailed(ValueError):
+    """
+    A malformed record stopped an import part way.
+
+    Attributes:
+    counts (dict): What the batches committed before the malformed record imported, as returned by import_records.
+    """
+
+    def __init__(self, message, counts):
+        super().__init__(message)
+        self.counts = counts
+
+def import_records(database, records, batch_size=1000):
+    """
+    Import records, writing each batch in its own transaction.
+
+    Habits whose name or ID already exists, in the database or earlier in the backup, are skipped
+    together with their tracking rows. Tracking rows of habits that are neither in the database
+    nor earlier in the backup are skipped as well.
+
+    Batches are committed as they fill up, so a malformed record does not undo the batches before
+    it: ImportFailed reports what they imported, and the batch holding the record is not written.
+
+    Parameters:
+    database (Database): The database to import into.
+    records (iterable): The records, as produced by parse_ndjson or parse_csv.
+    batch_size (int): The number of records written per transaction.
+
+    Returns:
+    dict: The number of habits and tracking rows imported and of habits and tracking rows skipped.
+
+    Raises:
+    ImportFailed: A record is malformed or could not be written.
+    """
+    counts = {'habits': 0, 'tracking': 0, 'skipped_habits': 0, 'skipped_tracking': 0}
+    skipped = set()
+    # the habits tracking rows may refer to: those imported from the backup, and those found in the database
+    known = set()
+    habits, tracking = [], []
+    # the names and IDs of the batch not yet written, which the existence checks cannot see
+    pending_names, pending_ids = set(), set()
+
+    def flush():
+        if habits or tracking:
+            database.bulk_insert(habits, tracking)
+            counts['habits'] += len(habits)
+            counts['tracking'] += len(tracking)
+            habits.clear()
+            tracking.clear()
+            pending_names.clear()
+            pending_ids.clear()
+
+    try:
+        for record in records:
+            if record['record'] == 'habit':
+                name = normalize_name(record['name'])
+                if (name in pending_names or record['id'] in pending_ids
+                        or database.habit_exists(record['name']) or database.habit_id_exists(record['id'])):
+                    skipped.add(record['id'])
+                    counts['skipped_habits'] += 1
+                    continue
+                if record['periodicity'] not in PERIODICITIES:
+                    raise ValueError(f"Invalid periodicity: {record['periodicity']!r}")
+                pending_names.add(name)
+                pending_ids.add(record['id'])
+                known.add(record['id'])
+                habits.append((
+                    record['id'], record['name'], record['periodicity'], _ordinal(record['created_at']),
+                    int(record['streak'] or 0), _ordinal(record['last_updated_at']), _ordinal(record.get('streak_started_at')),
+                ))
+            elif record['record'] == 'tracking' and record['id'] not in skipped:
+                marked_date = _ordinal(record['date'])
+                if record['id'] not in known:
+                    if not database.habit_id_exists(record['id']):
+                        counts['skipped_tracking'] += 1
+                        continue
+                    known.add(record['id'])
+                tracking.append((record['id'], marked_date))
+            if len(habits) + len(tracking) >= batch_size:
+                flush()
+        flush()
+    except (KeyError, TypeError, ValueError, sqlite3.IntegrityError) as e:
+        raise ImportFailed(str(e), counts) from e
+    return counts
+
+def main():
+    """Export or import a backup from the command line."""
+    parser = argparse.ArgumentParser(description='Export or import habits and their tracking history.')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='the backup file; .csv for CSV, anything else for NDJSON')
+    parser.add_argument('--batch-size', type=int, default=1000, help='records per batch')
+    args = parser.parse_args()
+
+    database = get_database()
+    is_csv = args.path.endswith('.csv')
+    if args.command == 'export':
+        export = export_csv if is_csv else export_ndjson
+        with open(args.path, 'w', newline='') as f:
+            for chunk in export(database, args.batch_size):
+                f.write(chunk)
+        print(f'Exported to {args.path}')
+    else:
+        with open(args.path, newline='') as f:
+            records = parse_csv(f) if is_csv else parse_ndjson(f)
+            try:
+                counts = import_records(database, records, args.batch_size)
+            except ImportFailed as e:
+                print(f"Invalid backup: {e}; imported {e.counts['habits']} habits and {e.counts['tracking']} tracking rows before it")
+                return 1
+        print(f"Imported {counts['habits']} habits and {counts['tracking']} tracking rows, skipped {counts['skipped_habits']} existing habits"
+              f" and {counts['skipped_tracking']} tracking rows of unknown habits")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Micro-benchmarks for every API route and the helpers in functions_helper.py.
+
+Each dataset is seeded into a temporary database and timed in its own subprocess, so the
+process-wide database never mixes datasets. Results are written as JSON and can be compared
+against a previous run to fail on regressions.
+
+Usage:
+    python benchmark.py --habits 10 1000 100000 --days 365 --output results.json
+    python benchmark.py --baseline results.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+PERIODICITIES = ['D', 'W', 'M']
+# days between two tracking rows for each periodicity
+MARK_EVERY = {'D': 1, 'W': 7, 'M': 30}
+
+def seed_database(database, habit_count, days):
+    """
+    Seed a database with generated habits and tracking history.
+
+    Parameters:
+    database (Database): The database to seed.
+    habit_count (int): The number of habits to create.
+    days (int): The number of days of history per habit.
+
+    Returns:
+    list: The (id, name) of every habit created.
+    """
+    today = datetime.now().date().toordinal()
+    habits = []
+    for i in range(habit_count):
+        periodicity = PERIODICITIES[i % len(PERIODICITIES)]
+        streak = i % 50
+        started_at = today - (streak - 1) * MARK_EVERY[periodicity] if streak else None
+        habits.append((str(uuid.uuid4()), f'Habit {i:06d}', periodicity, today - days, streak, today, started_at))
+
+    def tracking():
+        for habit_id, _, periodicity, *_ in habits:
+            for day in range(today - days, today + 1, MARK_EVERY[periodicity]):
+                yield habit_id, day
+
+    database.bulk_insert(habits, tracking())
+    return [(habit[0], habit[1]) for habit in habits]
+
+def time_call(function, repeat, setup=None):
+    """
+    Time a function.
+
+    Parameters:
+    function (callable): The function to time, called without arguments.
+    repeat (int): The number of timed calls.
+    setup (callable): Called without arguments and untimed before every call, e.g. to undo the
+        writes of the previous call.
+
+    Returns:
+    dict: The min, median and mean duration in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(durations), 4),
+        'median_ms': round(statistics.median(durations), 4),
+        'mean_ms': round(statistics.mean(durations), 4),
+    }
+
+def run_dataset(habit_count, days, repeat):
+    """
+    Seed one dataset and time every route and helper against it.
+
+    Read routes are timed first, on the seeded data; write routes then create and delete their own
+    habits, so the dataset keeps its size throughout.
+
+    Must run in a process whose HABITS_DB_PATH points at an empty database.
+
+    Parameters:
+    habit_count (int): The number of habits to create.
+    days (int): The number of days of history per habit.
+    repeat (int): The number of timed calls per benchmark.
+
+    Returns:
+    dict: The timings, keyed by benchmark name.
+    """
+    from app import app, db
+    import functions_helper
+
+    start = time.perf_counter()
+    habits = seed_database(db, habit_count, days)
+    results = {'seed': {'seconds': round(time.perf_counter() - start, 3)}}
+    habit_id, name = habits[0]
+    client = app.test_client()
+
+    def call(method, url, **kwargs):
+        response = client.open(url, method=method, **kwargs)
+        assert response.status_code == 200, (method, url, response.status_code)
+        return response.data
+
+    def get(url):
+        return call('GET', url)
+
+    def cold(url):
+        def uncached():
+            db.invalidate_cache()
+            return get(url)
+        return uncached
+
+    routes = {
+        'GET /habits': lambda: get('/habits'),
+        'GET /habits?include_status=true': lambda: get('/habits?include_status=true'),
+        'GET /habits?limit=100': lambda: get('/habits?limit=100'),
+        'GET /habits?periodicity=W&limit=100': lambda: get('/habits?periodicity=W&limit=100'),
+        'GET /habits?format=ndjson': lambda: get('/habits?format=ndjson'),
+        'GET /habits/<name>': cold(f'/habits/{name}'),
+        'GET /habits/tracking/<id>': lambda: get(f'/habits/tracking/{habit_id}'),
+        'GET /habits/tracking/<id>?format=bitset': lambda: get(f'/habits/tracking/{habit_id}?format=bitset'),
+        'GET /habits/tracking/<id>?year': lambda: get(f'/habits/tracking/{habit_id}?year={datetime.now().year}'),
+        'GET /habits/check/': lambda: get(f'/habits/check/?periodicity=D&last_updated_at={datetime.now().date().isoformat()}'),
+        'GET /streaks': cold('/streaks'),
+        'GET /streaks/daily': lambda: get('/streaks/daily'),
+        'GET /streaks/weekly': lambda: get('/streaks/weekly'),
+        'GET /streaks/monthly': lambda: get('/streaks/monthly'),
+        'GET /streaks/longest': lambda: get('/streaks/longest'),
+        'GET /habits/analytics': cold('/habits/analytics'),
+        'GET /habits/<name>/analytics': cold(f'/habits/{name}/analytics'),
+        'GET /rollup': lambda: get('/rollup'),
+        'GET /rollup?year': lambda: get(f'/rollup?year={datetime.now().year}'),
+        'GET /export': lambda: get('/export'),
+        'GET /export?format=csv': lambda: get('/export?format=csv'),
+    }
+    for benchmark, function in routes.items():
+        results[benchmark] = time_call(function, repeat)
+
+    backup = get('/export')
+    created = [f'Benchmark {i:06d}' for i in range(repeat)]
+    to_create, to_delete = iter(created), iter(created)
+    with open('test_data/predefined_habits.json') as f:
+        initial_names = [habit['name'] for habit in json.load(f)]
+
+    def delete_initial_habits():
+        for initial_name in initial_names:
+            client.delete(f'/habits/{initial_name}')
+
+    past_dates = [(datetime.now() - timedelta(days=day)).date().isoformat() for day in range(7)]
+    writes = {
+        'POST /habits': (lambda: call('POST', '/habits', json={'name': next(to_create), 'periodicity': 'D'}), None),
+        'PUT /habits/<name>': (lambda: call('PUT', f'/habits/{name}'), None),
+        'POST /habits/completions': (lambda: call('POST', '/habits/completions', json={'completions': [
+            {'id': habit, 'dates': past_dates} for habit, _ in habits[:100]
+        ]}), None),
+        'DELETE /habits/<name>': (lambda: call('DELETE', f'/habits/{next(to_delete)}'), None),
+        'POST /create_initial_habits': (lambda: call('POST', '/create_initial_habits'), delete_initial_habits),
+        # every habit of the backup already exists, so this times parsing and the existence checks
+        'POST /import (existing habits)': (lambda: call('POST', '/import', data=backup), None),
+    }
+    for benchmark, (function, setup) in writes.items():
+        results[benchmark] = time_call(function, repeat, setup)
+    delete_initial_habits()
+
+    now = datetime.now()
+    created_at = now - timedelta(days=days)
+    tracking_dates = [(now - timedelta(days=day)).date() for day in range(days, -1, -1)]
+    tracking_strings = [day.isoformat() for day in tracking_dates]
+    statuses = [(PERIODICITIES[i % 3], (now - timedelta(days=i % 40)).date().isoformat()) for i in range(habit_count)]
+    bitmaps = functions_helper.generate_tracking_bitmaps(tracking_dates, 'D')
+    helpers = {
+        'date_check_with_periodicity': lambda: functions_helper.date_check_with_periodicity('W', tracking_strings[0]),
+        'bulk_date_check_with_periodicity': lambda: functions_helper.bulk_date_check_with_periodicity(statuses),
+        'check_max_streak': lambda: functions_helper.check_max_streak('M', created_at, now),
+        'generate_random_habit_tracking_dates': lambda: functions_helper.generate_random_habit_tracking_dates('D', created_at, 10, now),
+        'generate_tracking_data_dict (D)': lambda: functions_helper.generate_tracking_data_dict(tracking_dates, 'D'),
+        'generate_tracking_data_dict (W, strings)': lambda: functions_helper.generate_tracking_data_dict(tracking_strings, 'W'),
+        'generate_tracking_bitmaps (M)': lambda: functions_helper.generate_tracking_bitmaps(tracking_dates, 'M'),
+        'encode_tracking_bitset': lambda: functions_helper.encode_tracking_bitset(bitmaps),
+    }
+    for benchmark, function in helpers.items():
+        results[f'helper {benchmark}'] = time_call(function, repeat)
+    return results
+
+def run_in_subprocess(habit_count, days, repeat):
+    """
+    Run one dataset in a fresh process with its own temporary database.
+
+    Parameters:
+    habit_count (int): The number of habits to create.
+    days (int): The number of days of history per habit.
+    repeat (int): The number of timed calls per benchmark.
+
+    Returns:
+    dict: The timings, keyed by benchmark name.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, HABITS_DB_PATH=os.path.join(directory, 'benchmark.db'))
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--dataset', str(habit_count), str(days), '--repeat', str(repeat)],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True, text=True
+        ).stdout
+    # the app prints progress messages; the results are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compare median timings against a baseline.
+
+    Parameters:
+    results (dict): The timings of this run.
+    baseline (dict): The timings of a previous run.
+    threshold (float): The allowed slowdown, as a fraction of the baseline median.
+
+    Returns:
+    list: A description of every benchmark that got slower than allowed.
+    """
+    regressions = []
+    for dataset, benchmarks in results['datasets'].items():
+        for benchmark, timing in benchmarks.items():
+            previous = baseline.get('datasets', {}).get(dataset, {}).get(benchmark)
+            if not previous or 'median_ms' not in timing:
+                continue
+            if timing['median_ms'] > previous['median_ms'] * (1 + threshold):
+                regressions.append(f"{dataset} {benchmark}: {previous['median_ms']}ms -> {timing['median_ms']}ms")
+    return regressions
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description='Benchmark the habit tracker routes and helpers.')
+    parser.add_argument('--habits', type=int, nargs='+', default=[10, 1000, 10000], help='habit counts, one dataset each')
+    parser.add_argument('--days', type=int, default=365, help='days of tracking history per habit')
+    parser.add_argument('--repeat', type=int, default=20, help='timed calls per benchmark')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--dataset', type=int, nargs=2, metavar=('HABITS', 'DAYS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dataset:
+        print(json.dumps(run_dataset(*args.dataset, args.repeat)))
+        return 0
+
+    results = {
+        'meta': {'created_at': datetime.now().isoformat(), 'python': sys.version.split()[0], 'days': args.days, 'repeat': args.repeat},
+        'datasets': {},
+    }
+    for habit_count in args.habits:
+        dataset = f'habits={habit_count},days={args.days}'
+        print(f'Running {dataset}')
+        results['datasets'][dataset] = run_in_subprocess(habit_count, args.days, args.repeat)
+        for benchmark, timing in results['datasets'][dataset].items():
+            print(f'  {benchmark:<45} {timing}')
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        if regressions:
+            print('Regressions:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('No regressions')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
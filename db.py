@@ -1,46 +1,726 @@
+import bisect
+import os
+import re
 import sqlite3
+import threading
+import time
+import weakref
+import functools
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import date
+from analytics import compute_analytics
+
+HABITS_TABLE = """
+    CREATE TABLE IF NOT EXISTS habits (
+        id UUID,
+        name TEXT, 
+        periodicity TEXT, 
+        created_at TEXT, 
+        streak INTEGER, 
+        last_updated_at DATE,
+        PRIMARY KEY (id)
+    )
+"""
+
+HABIT_TRACKING_TABLE = """
+    CREATE TABLE IF NOT EXISTS habit_tracking (
+        habit_id UUID,
+        marked_date DATE
+    )
+"""
+
+# Finds the date each habit's current streak started from its tracking history. Only used to
+# backfill habits.streak_started_at when upgrading databases created before schema version 3.
+STREAK_DATES_CTE = """
+    WITH RankedDates AS (
+        SELECT
+            h.id AS habit_id,
+            h.name AS habit_name,
+            ht.marked_date,
+            h.streak,
+            ROW_NUMBER() OVER (PARTITION BY h.id ORDER BY ht.marked_date DESC) AS rank
+        FROM
+            habits h
+        LEFT JOIN
+            habit_tracking ht ON h.id = ht.habit_id
+    ),
+    StreakDates AS (
+        SELECT
+            habit_id,
+            habit_name,
+            streak,
+            CASE
+                WHEN streak = 0 THEN NULL
+                ELSE (
+                    SELECT marked_date
+                    FROM RankedDates r2
+                    WHERE r2.habit_id = r1.habit_id AND r2.rank = r1.streak
+                )
+            END AS streak_date
+        FROM
+            (SELECT DISTINCT habit_id, habit_name, streak FROM RankedDates) r1
+    )
+"""
+
+def normalize_name(name):
+    """
+    Normalize a habit name for exact, case-insensitive lookups.
+
+    Parameters:
+    name (str): The name of the habit.
+
+    Returns:
+    str: The normalized name.
+    """
+    return name.strip().lower()
+
+def _backfill_normalized_names(cur):
+    """
+    Fill habits.normalized_name for habits created before schema version 5.
+
+    Names that only differ in case or surrounding whitespace would share a normalized name, so
+    all but the oldest of them are renamed with a numeric suffix, e.g. 'Read (2)'.
+
+    Parameters:
+    cur (sqlite3.Cursor): The cursor of the running migration.
+    """
+    cur.execute('SELECT id, name FROM habits ORDER BY created_at, id')
+    habits = cur.fetchall()
+    existing = {normalize_name(name) for _, name in habits}
+    taken, rows = set(), []
+    for habit_id, name in habits:
+        normalized = normalize_name(name)
+        if normalized in taken:
+            suffix = 2
+            while normalize_name(f'{name.strip()} ({suffix})') in existing | taken:
+                suffix += 1
+            name = f'{name.strip()} ({suffix})'
+            normalized = normalize_name(name)
+        taken.add(normalized)
+        rows.append((name, normalized, habit_id))
+    cur.executemany('UPDATE habits SET name = ?, normalized_name = ? WHERE id = ?', rows)
+
+@functools.lru_cache(maxsize=4096)
+def ordinal_to_iso(ordinal):
+    """
+    Format a stored day ordinal as an ISO date. Listings repeat few distinct dates, so results are cached.
+
+    Parameters:
+    ordinal (int): The proleptic Gregorian day ordinal, as returned by date.toordinal().
+
+    Returns:
+    str: The date as 'YYYY-MM-DD', or None if the ordinal is None.
+    """
+    return date.fromordinal(ordinal).isoformat() if ordinal is not None else None
+
+def _iso_to_ordinal_sql(column):
+    """
+    Build the SQL expression that converts an ISO date or timestamp column to a day ordinal.
+
+    Parameters:
+    column (str): The name of the column.
+
+    Returns:
+    str: The SQL expression. NULL stays NULL.
+    """
+    # julianday('0001-01-01') is 1721425.5 and date(1, 1, 1).toordinal() is 1
+    return f"CAST(julianday(substr({column}, 1, 10)) - 1721424.5 AS INTEGER)"
+
+HABITS_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_name ON habits (name)',
+    'CREATE INDEX IF NOT EXISTS idx_habits_periodicity_streak ON habits (periodicity, streak)',
+    'CREATE INDEX IF NOT EXISTS idx_habits_streak_started_at ON habits (streak_started_at)',
+    'CREATE INDEX IF NOT EXISTS idx_habits_periodicity_id ON habits (periodicity, id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_normalized_name ON habits (normalized_name)',
+]
+
+# Completions per day and periodicity, so overview charts never aggregate the raw history.
+# active_habits counts the distinct habits completed that day.
+DAILY_ROLLUP_TABLE = """
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        day INTEGER,
+        periodicity TEXT,
+        completions INTEGER,
+        active_habits INTEGER,
+        PRIMARY KEY (day, periodicity)
+    ) WITHOUT ROWID
+"""
+
+DAILY_ROLLUP_SELECT = """
+    SELECT
+        ht.marked_date,
+        h.periodicity,
+        COUNT(*),
+        COUNT(DISTINCT ht.habit_id)
+    FROM
+        habit_tracking ht
+    JOIN
+        habits h ON h.id = ht.habit_id
+    GROUP BY
+        ht.marked_date, h.periodicity
+"""
+
+# Keep daily_rollup up to date on every write to habit_tracking, whichever code path makes it.
+# The habit must exist while its tracking rows are inserted or deleted.
+DAILY_ROLLUP_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_insert AFTER INSERT ON habit_tracking
+    BEGIN
+        INSERT INTO daily_rollup (day, periodicity, completions, active_habits)
+        SELECT NEW.marked_date, periodicity, 1, 1 FROM habits WHERE id = NEW.habit_id
+        ON CONFLICT (day, periodicity) DO UPDATE SET
+            completions = completions + 1,
+            active_habits = active_habits + (
+                SELECT COUNT(*) = 1 FROM habit_tracking WHERE habit_id = NEW.habit_id AND marked_date = NEW.marked_date
+            );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_delete AFTER DELETE ON habit_tracking
+    BEGIN
+        UPDATE daily_rollup SET
+            completions = completions - 1,
+            active_habits = active_habits - NOT EXISTS (
+                SELECT 1 FROM habit_tracking WHERE habit_id = OLD.habit_id AND marked_date = OLD.marked_date
+            )
+        WHERE day = OLD.marked_date AND periodicity = (SELECT periodicity FROM habits WHERE id = OLD.habit_id);
+        DELETE FROM daily_rollup WHERE day = OLD.marked_date AND completions = 0;
+    END
+    """,
+]
+
+# The daily rollup from schema version 9 on, without active_habits: the active habits per day
+# are kept in habit_activity instead.
+DAILY_ROLLUP_V9_TABLE = """
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        day INTEGER,
+        periodicity TEXT,
+        completions INTEGER,
+        PRIMARY KEY (day, periodicity)
+    ) WITHOUT ROWID
+"""
+
+DAILY_ROLLUP_V9_BACKFILL = """
+    INSERT INTO daily_rollup (day, periodicity, completions)
+    SELECT
+        ht.marked_date,
+        h.periodicity,
+        COUNT(*)
+    FROM
+        habit_tracking ht
+    JOIN
+        habits h ON h.id = ht.habit_id
+    GROUP BY
+        ht.marked_date, h.periodicity
+"""
+
+DAILY_ROLLUP_V9_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_insert AFTER INSERT ON habit_tracking
+    BEGIN
+        INSERT INTO daily_rollup (day, periodicity, completions)
+        SELECT NEW.marked_date, periodicity, 1 FROM habits WHERE id = NEW.habit_id
+        ON CONFLICT (day, periodicity) DO UPDATE SET completions = completions + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_delete AFTER DELETE ON habit_tracking
+    BEGIN
+        UPDATE daily_rollup SET completions = completions - 1
+        WHERE day = OLD.marked_date AND periodicity = (SELECT periodicity FROM habits WHERE id = OLD.habit_id);
+        DELETE FROM daily_rollup WHERE day = OLD.marked_date AND completions = 0;
+    END
+    """,
+]
+
+# Habits activated (+1) and deactivated (-1) per day and periodicity; the running total up to a
+# day is the number of habits active that day. A habit is active from its creation, or from its
+# first completion if that is earlier, until the day it is deleted.
+HABIT_ACTIVITY_TABLE = """
+    CREATE TABLE IF NOT EXISTS habit_activity (
+        day INTEGER,
+        periodicity TEXT,
+        delta INTEGER,
+        PRIMARY KEY (day, periodicity)
+    ) WITHOUT ROWID
+"""
+
+HABIT_ACTIVITY_BACKFILL = [
+    """
+    UPDATE habits SET active_since = MIN(
+        created_at, COALESCE((SELECT MIN(marked_date) FROM habit_tracking WHERE habit_id = habits.id), created_at)
+    )
+    """,
+    """
+    INSERT INTO habit_activity (day, periodicity, delta)
+    SELECT active_since, periodicity, COUNT(*) FROM habits WHERE active_since IS NOT NULL
+    GROUP BY active_since, periodicity
+    """,
+]
+
+# Keep habit_activity and habits.active_since up to date on every create, completion and delete,
+# whichever code path makes it.
+HABIT_ACTIVITY_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS habits_activity_insert AFTER INSERT ON habits
+    BEGIN
+        UPDATE habits SET active_since = MIN(
+            NEW.created_at, COALESCE((SELECT MIN(marked_date) FROM habit_tracking WHERE habit_id = NEW.id), NEW.created_at)
+        ) WHERE id = NEW.id;
+        INSERT INTO habit_activity (day, periodicity, delta)
+        SELECT active_since, periodicity, 1 FROM habits WHERE id = NEW.id AND active_since IS NOT NULL
+        ON CONFLICT (day, periodicity) DO UPDATE SET delta = delta + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS habit_tracking_activity_insert AFTER INSERT ON habit_tracking
+    WHEN NEW.marked_date < (SELECT active_since FROM habits WHERE id = NEW.habit_id)
+    BEGIN
+        UPDATE habit_activity SET delta = delta - 1
+        WHERE (day, periodicity) = (SELECT active_since, periodicity FROM habits WHERE id = NEW.habit_id);
+        INSERT INTO habit_activity (day, periodicity, delta)
+        SELECT NEW.marked_date, periodicity, 1 FROM habits WHERE id = NEW.habit_id
+        ON CONFLICT (day, periodicity) DO UPDATE SET delta = delta + 1;
+        UPDATE habits SET active_since = NEW.marked_date WHERE id = NEW.habit_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS habits_activity_delete AFTER DELETE ON habits
+    WHEN OLD.active_since IS NOT NULL
+    BEGIN
+        INSERT INTO habit_activity (day, periodicity, delta)
+        SELECT CAST(julianday(date('now', 'localtime')) - 1721424.5 AS INTEGER), OLD.periodicity, -1 WHERE true
+        ON CONFLICT (day, periodicity) DO UPDATE SET delta = delta - 1;
+    END
+    """,
+]
+
+# Bump the write counter in the transaction of every write to habits and habit_tracking,
+# whichever code path makes it, so the counter cannot miss a committed write
+DATA_VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {table}_data_version_{event.lower()} AFTER {event} ON {table}
+    BEGIN
+        UPDATE data_version SET version = version + 1;
+    END
+    """
+    for table in ('habits', 'habit_tracking') for event in ('INSERT', 'UPDATE', 'DELETE')
+]
+
+# Ordered list of (version, steps), where a step is a SQL statement or a function taking the
+# migration's cursor. Each version is applied once, inside its own transaction, and recorded
+# in the schema_version table. Only ever append to this list.
+MIGRATIONS = [
+    (1, [HABITS_TABLE, HABIT_TRACKING_TABLE]),
+    (2, [
+        'CREATE INDEX IF NOT EXISTS idx_habit_tracking_habit_date ON habit_tracking (habit_id, marked_date)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_name ON habits (name)',
+        'CREATE INDEX IF NOT EXISTS idx_habits_periodicity_streak ON habits (periodicity, streak)',
+    ]),
+    # store the start of the current streak so the longest active streak is an index lookup
+    (3, [
+        'ALTER TABLE habits ADD COLUMN streak_started_at DATE',
+        f"""
+        {STREAK_DATES_CTE}
+        UPDATE habits SET streak_started_at = (
+            SELECT streak_date FROM StreakDates WHERE StreakDates.habit_id = habits.id
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS idx_habits_streak_started_at ON habits (streak_started_at)',
+    ]),
+    # serve keyset pagination of habits filtered by periodicity
+    (4, [
+        'CREATE INDEX IF NOT EXISTS idx_habits_periodicity_id ON habits (periodicity, id)',
+    ]),
+    # exact, indexable name lookups instead of LOWER(name) LIKE '%name%'
+    (5, [
+        'ALTER TABLE habits ADD COLUMN normalized_name TEXT',
+        _backfill_normalized_names,
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_habits_normalized_name ON habits (normalized_name)',
+    ]),
+    # store every date as an integer day ordinal instead of ISO text; habits is rebuilt
+    # because created_at has TEXT affinity, which would turn the integers back into text
+    (6, [
+        """
+        CREATE TABLE habits_v6 (
+            id UUID,
+            name TEXT,
+            periodicity TEXT,
+            created_at INTEGER,
+            streak INTEGER,
+            last_updated_at INTEGER,
+            streak_started_at INTEGER,
+            normalized_name TEXT,
+            PRIMARY KEY (id)
+        )
+        """,
+        f"""
+        INSERT INTO habits_v6
+        SELECT id, name, periodicity, {_iso_to_ordinal_sql('created_at')}, streak,
+               {_iso_to_ordinal_sql('last_updated_at')}, {_iso_to_ordinal_sql('streak_started_at')}, normalized_name
+        FROM habits
+        """,
+        'DROP TABLE habits',
+        'ALTER TABLE habits_v6 RENAME TO habits',
+        *HABITS_INDEXES,
+        f"UPDATE habit_tracking SET marked_date = {_iso_to_ordinal_sql('marked_date')}",
+    ]),
+    # pre-aggregate completions per day and periodicity, backfilled from the existing history
+    (7, [
+        DAILY_ROLLUP_TABLE,
+        f'INSERT INTO daily_rollup (day, periodicity, completions, active_habits) {DAILY_ROLLUP_SELECT}',
+        *DAILY_ROLLUP_TRIGGERS,
+    ]),
+    # a write counter shared by every process using the file, so versions (ETags) and the
+    # in-process caches notice writes made by other processes
+    (8, [
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            token TEXT NOT NULL,
+            version INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO data_version (id, token, version) VALUES (0, lower(hex(randomblob(4))), 0)",
+    ]),
+    # drop daily_rollup.active_habits, which only counted the habits completed that day
+    (9, [
+        'DROP TRIGGER IF EXISTS habit_tracking_rollup_insert',
+        'DROP TRIGGER IF EXISTS habit_tracking_rollup_delete',
+        'DROP TABLE IF EXISTS daily_rollup',
+        DAILY_ROLLUP_V9_TABLE,
+        DAILY_ROLLUP_V9_BACKFILL,
+        *DAILY_ROLLUP_V9_TRIGGERS,
+    ]),
+    # the habits active per day, as activation deltas summed on read
+    (10, [
+        'ALTER TABLE habits ADD COLUMN active_since INTEGER',
+        HABIT_ACTIVITY_TABLE,
+        *HABIT_ACTIVITY_BACKFILL,
+        *HABIT_ACTIVITY_TRIGGERS,
+    ]),
+    # bump data_version inside the transactions that write, not in one of its own after them
+    (11, DATA_VERSION_TRIGGERS),
+]
+
+LONGEST_ACTIVE_STREAK_SELECT = """
+    SELECT
+        name,
+        streak_started_at,
+        streak
+    FROM
+        habits
+    WHERE
+        streak_started_at IS NOT NULL
+    ORDER BY
+        streak_started_at
+    LIMIT 1
+"""
+
+class LRUCache:
+    """
+    A thread-safe, bounded mapping that evicts the least recently used entry when full.
+    Methods:
+        get: Get a cached value.
+        put: Cache a value.
+        pop: Remove a cached value.
+        clear: Remove every cached value.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Initialize the cache.
+
+        Parameters:
+        maxsize (int): The maximum number of entries kept.
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        Parameters:
+        key: The key of the entry.
+
+        Returns:
+        The cached value, or None if the key is not cached.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if the cache is full.
+
+        Parameters:
+        key: The key of the entry.
+        value: The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Remove a cached value.
+
+        Parameters:
+        key: The key of the entry.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every cached value."""
+        with self._lock:
+            self._entries.clear()
+
+class TracedCursor(sqlite3.Cursor):
+    """
+    A cursor that reports every statement and its duration to the database's statement hook.
+    Methods:
+        execute: Execute a statement.
+        executemany: Execute a statement for every row of parameters.
+    """
+
+    def __init__(self, conn, database):
+        """
+        Initialize the cursor.
+
+        Parameters:
+        conn (sqlite3.Connection): The connection the cursor belongs to.
+        database (Database): The database whose statement hook is called.
+        """
+        super().__init__(conn)
+        self.database = database
+
+    def execute(self, sql, parameters=()):
+        """Execute a statement, reporting it to the statement hook if one is set."""
+        hook = self.database.statement_hook
+        if hook is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            hook(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        """Execute a statement for every row of parameters, reporting it to the statement hook if one is set."""
+        hook = self.database.statement_hook
+        if hook is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            hook(sql, time.perf_counter() - start)
+
+class ConnectionPool:
+    """
+    A pool that hands every thread its own SQLite connection.
+
+    Connections left behind by finished threads are rolled back and handed to the next
+    thread that asks for one, so the pool only grows with the number of concurrent threads.
+    Methods:
+        get_connection: Get the connection of the calling thread.
+        close: Close every connection opened by the pool.
+    """
+
+    def __init__(self, path, journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000):
+        """
+        Initialize the connection pool.
+
+        Parameters:
+        path (str): The path of the SQLite database file.
+        journal_mode (str): The SQLite journal mode of every connection.
+        synchronous (str): The SQLite synchronous level of every connection ('OFF', 'NORMAL', 'FULL').
+        busy_timeout (int): How long a connection waits for a lock, in milliseconds.
+        """
+        self.path = path
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    def get_connection(self):
+        """
+        Get the connection of the calling thread.
+
+        Returns:
+        sqlite3.Connection: A connection used only by the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        thread = threading.current_thread()
+        with self._lock:
+            conn = self._reclaim() or self._connect()
+            self._connections[thread] = conn
+        self._local.conn = conn
+        return conn
+
+    def _reclaim(self):
+        """
+        Take over the connection of a thread that has finished.
+
+        Returns:
+        sqlite3.Connection: A reusable connection, or None if every owner is still alive.
+        """
+        for thread, conn in list(self._connections.items()):
+            if not thread.is_alive():
+                del self._connections[thread]
+                conn.rollback()
+                return conn
+        return None
+
+    def _connect(self):
+        """
+        Open a new connection and apply the configured pragmas.
+
+        Returns:
+        sqlite3.Connection: The new connection.
+        """
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        return conn
+
+    def close(self):
+        """Close every connection opened by the pool."""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
 class Database:
     """
-    A class to represent a database connection.
+    A class to represent a database backed by a per-thread connection pool.
     Methods:
         get_cursor: Get a new database cursor.
+        set_statement_hook: Set the function called after every statement.
+        get_schema_version: Get the current schema version.
+        migrate: Apply pending schema migrations.
         habit_exists: Check if a habit exists by name.
-        close: Close the database connection.
+        habit_id_exists: Check if a habit exists by ID.
+        get_habit_by_name: Get a habit by its exact name through the habit cache.
+        bulk_insert: Insert many habits and tracking rows in a single transaction.
+        backup: Copy the database to another file.
+        restore: Replace the contents of the database with those of a snapshot.
+        close: Close every connection of the pool.
         clear_habits_table: Clear the habits and habit tracking tables.
+        invalidate_cache: Invalidate cached query results after a write.
+        get_data_version: Get a version string that changes after every write.
+        get_longest_active_streak: Get the longest active streak.
+        get_streak_summary: Get all longest streaks in one cached query.
+        get_analytics: Get the cached analytics of one habit or of all habits.
+        get_daily_rollup: Get the completions per day and periodicity.
+        rebuild_daily_rollup: Regenerate the daily rollup from the tracking history.
     """
 
-    def __init__(self):
-        """Initialize the database connection and create tables if they do not exist."""
-        self.conn = sqlite3.connect('habits.db', check_same_thread=False)
-        self.cur = self.conn.cursor()
-        self.cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS habits (
-                id UUID,
-                name TEXT, 
-                periodicity TEXT, 
-                created_at TEXT, 
-                streak INTEGER, 
-                last_updated_at DATE,
-                PRIMARY KEY (id)
-            )
-            """
-        )
-        self.cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS habit_tracking (
-                habit_id UUID,
-                marked_date DATE
-            )
-            """
-        )
-        self.conn.commit()
-        self.cur.close()
+    def __init__(self, path='habits.db', journal_mode='WAL', synchronous='NORMAL', busy_timeout=5000, habit_cache_size=1024):
+        """
+        Initialize the connection pool and bring the schema up to date.
+
+        Parameters:
+        path (str): The path of the SQLite database file.
+        journal_mode (str): The SQLite journal mode of every connection.
+        synchronous (str): The SQLite synchronous level of every connection ('OFF', 'NORMAL', 'FULL').
+        busy_timeout (int): How long a connection waits for a lock, in milliseconds.
+        habit_cache_size (int): The number of habits kept in the name lookup cache.
+        """
+        self.pool = ConnectionPool(path, journal_mode=journal_mode, synchronous=synchronous, busy_timeout=busy_timeout)
+        self._cache_lock = threading.Lock()
+        self._generation = 0
+        self._data_version = None
+        self.habit_cache = LRUCache(habit_cache_size)
+        self.analytics_cache = LRUCache(habit_cache_size)
+        self.statement_hook = None
+        self._cursor_factory = functools.partial(TracedCursor, database=self)
+        self._streak_summary = None
+        self._analytics = None
+        self.migrate()
+
+    @property
+    def conn(self):
+        """The connection of the calling thread."""
+        return self.pool.get_connection()
 
     def get_cursor(self):
         """Get a new database cursor."""
-        return self.conn.cursor()
+        return self.conn.cursor(self._cursor_factory)
+
+    def set_statement_hook(self, hook):
+        """
+        Set the function called after every statement run through a cursor of this database.
+
+        Parameters:
+        hook (callable): Called with the SQL statement and its duration in seconds, or None to remove it.
+        """
+        self.statement_hook = hook
+
+    def get_schema_version(self):
+        """
+        Get the current schema version.
+
+        Returns:
+        int: The highest applied migration version, 0 for a database without one.
+        """
+        cur = self.get_cursor()
+        cur.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+        cur.execute('SELECT MAX(version) FROM schema_version')
+        version = cur.fetchone()[0]
+        cur.close()
+        return version or 0
+
+    def migrate(self):
+        """
+        Apply pending schema migrations.
+
+        Existing databases created before versioning start at version 0 and are upgraded in place.
+
+        Returns:
+        int: The schema version after migrating.
+        """
+        version = self.get_schema_version()
+        cur = self.get_cursor()
+        for target, steps in MIGRATIONS:
+            if target <= version:
+                continue
+            # take the write lock first and re-read the version under it, so processes opening
+            # the same old database at once apply every migration exactly once between them
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute('SELECT MAX(version) FROM schema_version')
+                version = cur.fetchone()[0] or 0
+                if target > version:
+                    for step in steps:
+                        if callable(step):
+                            step(cur)
+                        else:
+                            cur.execute(step)
+                    cur.execute('INSERT INTO schema_version (version) VALUES (?)', (target,))
+                    version = target
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                cur.close()
+                raise
+        cur.close()
+        return version
     
     def habit_exists(self, habit_name):
         """
@@ -49,47 +729,166 @@ class Database:
         Parameters:
         habit_name (str): The name of the habit.
 
+        Returns:
+        bool: True if the habit exists, False otherwise.
+        """
+        return self.get_habit_by_name(habit_name) is not None
+
+    def habit_id_exists(self, habit_id):
+        """
+        Check if a habit exists by ID.
+
+        Parameters:
+        habit_id (str): The ID of the habit.
+
         Returns:
         bool: True if the habit exists, False otherwise.
         """
         cur = self.get_cursor()
-        cur.execute("SELECT 1 FROM habits WHERE name = ?", (habit_name,))
+        cur.execute('SELECT 1 FROM habits WHERE id = ?', (habit_id,))
         row = cur.fetchone()
         cur.close()
         return row is not None
 
+    def get_habit_by_name(self, habit_name):
+        """
+        Get a habit by its exact name, ignoring case and surrounding whitespace.
+
+        Hits are served from the habit cache; misses read the normalized_name index.
+
+        Parameters:
+        habit_name (str): The name of the habit.
+
+        Returns:
+        tuple: The (id, name, periodicity, created_at, streak, last_updated_at) row, or None.
+        """
+        key = normalize_name(habit_name)
+        self.get_data_version()
+        habit = self.habit_cache.get(key)
+        if habit is not None:
+            return habit
+        generation = self._generation
+        cur = self.get_cursor()
+        cur.execute('SELECT id, name, periodicity, created_at, streak, last_updated_at FROM habits WHERE normalized_name = ?', (key,))
+        habit = cur.fetchone()
+        cur.close()
+        # a write that raced with this read may already have invalidated the row
+        if habit is not None:
+            with self._cache_lock:
+                if generation == self._generation:
+                    self.habit_cache.put(key, habit)
+        return habit
+
+    def bulk_insert(self, habits, tracking):
+        """
+        Insert many habits and tracking rows in a single transaction.
+
+        Parameters:
+        habits (iterable): Rows of (id, name, periodicity, created_at, streak, last_updated_at, streak_started_at),
+            with dates as day ordinals. The normalized name is derived from the name.
+        tracking (iterable): Rows of (habit_id, marked_date), with dates as day ordinals.
+        """
+        cur = self.get_cursor()
+        try:
+            cur.executemany('INSERT INTO habits (id, name, periodicity, created_at, streak, last_updated_at, streak_started_at, normalized_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', 
+                            ((*habit, normalize_name(habit[1])) for habit in habits))
+            cur.executemany('INSERT INTO habit_tracking (habit_id, marked_date) VALUES (?, ?)', tracking)
+            self.conn.commit()
+            self.invalidate_cache()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def backup(self, path):
+        """
+        Copy the database to another file with SQLite's online backup API.
+
+        Parameters:
+        path (str): The path of the copy, overwritten if it exists.
+        """
+        target = sqlite3.connect(path)
+        try:
+            self.conn.backup(target)
+        finally:
+            target.close()
+
+    def restore(self, snapshot):
+        """
+        Replace the contents of the database with those of a snapshot, using SQLite's online backup API.
+
+        The copy gets a token of its own, so its versions never repeat those of the snapshot.
+
+        Parameters:
+        snapshot (Database): The database to copy from.
+        """
+        snapshot.conn.backup(self.conn)
+        self.conn.execute('UPDATE data_version SET token = lower(hex(randomblob(4))), version = 0')
+        self.conn.commit()
+        self.invalidate_cache()
+
     def close(self):
-        """Close the database connection."""
-        self.conn.close()
+        """Close every connection of the pool."""
+        self.pool.close()
 
     def clear_habits_table(self):
-        """Clear the habits and habit tracking tables."""
+        """Clear the habits, habit tracking, daily rollup and habit activity tables."""
         cur = self.get_cursor()
         cur.execute('DROP TABLE IF EXISTS habits')
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS habits (
-                id UUID,
-                name TEXT, 
-                periodicity TEXT, 
-                created_at TEXT, 
-                streak INTEGER, 
-                last_updated_at DATE,
-                PRIMARY KEY (id)
-            )
-            """
-        )
         cur.execute('DROP TABLE IF EXISTS habit_tracking')
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS habit_tracking (
-                habit_id UUID,
-                marked_date DATE
-            )
-            """
-        )
+        cur.execute('DROP TABLE IF EXISTS daily_rollup')
+        cur.execute('DROP TABLE IF EXISTS habit_activity')
+        cur.execute('DROP TABLE IF EXISTS schema_version')
+        # dropping tables fires no triggers
+        cur.execute('UPDATE data_version SET version = version + 1')
         self.conn.commit()
         cur.close()
+        self.migrate()
+        self.invalidate_cache()
+
+    def invalidate_cache(self, habit_name=None):
+        """
+        Invalidate cached query results after a write.
+
+        The write itself bumped the write counter in the database through the data_version
+        triggers, so other processes invalidate theirs; this only records the new version.
+
+        Parameters:
+        habit_name (str): The habit that was written, or None if any habit may have changed.
+        """
+        # a plain cursor: the version check is bookkeeping, not a statement of the request
+        token, version = self.conn.execute('SELECT token, version FROM data_version').fetchone()
+        with self._cache_lock:
+            self._generation += 1
+            self._data_version = f'{token}-{version}'
+        if habit_name is None:
+            self.habit_cache.clear()
+            self.analytics_cache.clear()
+        else:
+            self.habit_cache.pop(normalize_name(habit_name))
+            self.analytics_cache.pop(normalize_name(habit_name))
+
+    def get_data_version(self):
+        """
+        Get a version string that changes after every write, by this or any other process.
+
+        The version is read from the database. If another process wrote since the last read,
+        every cached query result is dropped.
+
+        Returns:
+        str: The current data version: a random token of the database file and its write counter.
+        """
+        # a plain cursor: the version check is bookkeeping, not a statement of the request
+        token, version = self.conn.execute('SELECT token, version FROM data_version').fetchone()
+        data_version = f'{token}-{version}'
+        if data_version != self._data_version:
+            with self._cache_lock:
+                self._generation += 1
+                self._data_version = data_version
+            self.habit_cache.clear()
+            self.analytics_cache.clear()
+        return data_version
 
     def get_longest_active_streak(self):
         """
@@ -99,53 +898,579 @@ class Database:
         int: The longest active streak.
         """
         cur = self.get_cursor()
+        cur.execute(LONGEST_ACTIVE_STREAK_SELECT)
+        result = cur.fetchone()
+        cur.close()
+        if result is None:
+            return None, None, None
+        name, started_at, streak = result
+        return name, ordinal_to_iso(started_at), streak
+
+    def get_streak_summary(self):
+        """
+        Get the longest daily, weekly and monthly streaks and the longest active streak.
+
+        All four are read in a single query, and the result is cached until the next write.
+
+        Returns:
+        dict: The 'daily', 'weekly' and 'monthly' streaks as [[name, streak]] lists, and the
+        'longest' active streak as a dict with 'habit', 'date' and 'streak'.
+        """
+        self.get_data_version()
+        generation = self._generation
+        cached = self._streak_summary
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        cur = self.get_cursor()
         cur.execute(
-            """
-            WITH RankedDates AS (
-                SELECT
-                    h.id AS habit_id,
-                    h.name AS habit_name,
-                    ht.marked_date,
-                    h.streak,
-                    ROW_NUMBER() OVER (PARTITION BY h.id ORDER BY ht.marked_date DESC) AS rank
-                FROM
-                    habits h
-                LEFT JOIN
-                    habit_tracking ht ON h.id = ht.habit_id
-            ),
-            StreakDates AS (
-                SELECT
-                    habit_id,
-                    habit_name,
-                    streak,
-                    CASE
-                        WHEN streak = 0 THEN NULL
-                        ELSE (
-                            SELECT marked_date
-                            FROM RankedDates r2
-                            WHERE r2.habit_id = r1.habit_id AND r2.rank = r1.streak
-                        )
-                    END AS streak_date
-                FROM
-                    (SELECT DISTINCT habit_id, habit_name, streak FROM RankedDates) r1
+            f"""
+            SELECT 'D', name, MAX(streak), NULL FROM habits WHERE periodicity = 'D'
+            UNION ALL
+            SELECT 'W', name, MAX(streak), NULL FROM habits WHERE periodicity = 'W'
+            UNION ALL
+            SELECT 'M', name, MAX(streak), NULL FROM habits WHERE periodicity = 'M'
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'longest', name, streak, streak_started_at FROM ({LONGEST_ACTIVE_STREAK_SELECT})
             )
-            SELECT
-                habit_name,
-                streak_date,
-                streak
-            FROM
-                StreakDates
-            WHERE
-                streak_date IS NOT NULL
-            ORDER BY
-                streak_date
-            LIMIT 1
             """
         )
-        result = cur.fetchone()
-        if result is None:
-            return None, None, None
-        name, date, streak = result
+        rows = cur.fetchall()
+        cur.close()
+        summary = {'longest': {'habit': None, 'date': None, 'streak': None}}
+        keys = {'D': 'daily', 'W': 'weekly', 'M': 'monthly'}
+        for kind, name, streak, started_at in rows:
+            if kind == 'longest':
+                summary['longest'] = {'habit': name, 'date': ordinal_to_iso(started_at), 'streak': streak}
+            else:
+                summary[keys[kind]] = [[name, streak]]
+        self._streak_summary = (generation, summary)
+        return summary
+
+    def get_analytics(self, habit_name=None):
+        """
+        Get the analytics of one habit, or of all habits together.
+
+        The analytics of a habit are cached until that habit is next written; those of all
+        habits until any habit is written. Both are recomputed when the day changes.
+
+        Parameters:
+        habit_name (str): The name of the habit, or None for all habits.
+
+        Returns:
+        dict: The analytics, as returned by compute_analytics, or None if the habit does not exist.
+        """
+        today = date.today().toordinal()
+        self.get_data_version()
+        generation = self._generation
+        if habit_name is None:
+            cached = self._analytics
+            if cached is not None and cached[0] == (generation, today):
+                return cached[1]
+            habit_id = None
+        else:
+            key = normalize_name(habit_name)
+            cached = self.analytics_cache.get(key)
+            if cached is not None and cached[0] == today:
+                return cached[1]
+            habit = self.get_habit_by_name(habit_name)
+            if habit is None:
+                return None
+            habit_id = habit[0]
+        cur = self.get_cursor()
+        analytics = compute_analytics(cur, habit_id, today)
+        cur.close()
+        if habit_name is None:
+            self._analytics = ((generation, today), analytics)
+        else:
+            # a write that raced with this read may already have invalidated the analytics
+            with self._cache_lock:
+                if generation == self._generation:
+                    self.analytics_cache.put(key, (today, analytics))
+        return analytics
+
+    def get_daily_rollup(self, start=None, end=None, periodicity=None):
+        """
+        Get the completions per day and periodicity.
+
+        Parameters:
+        start (date): Only return days on or after this one.
+        end (date): Only return days on or before this one.
+        periodicity (str): Only return this periodicity ('D', 'W', 'M').
+
+        The active habits are the running total of the habit_activity deltas up to each day, so
+        habits deleted since still count for the days they were active.
+
+        Returns:
+        list: Rows of (day as ISO date, periodicity, completions, habits of the periodicity active
+        that day), in day order.
+        """
+        # activity before the start still counts towards the running totals, so only rollup rows are cut there
+        conditions, params = [], []
+        if end is not None:
+            conditions.append('day <= ?')
+            params.append(end.toordinal())
+        if periodicity:
+            conditions.append('periodicity = ?')
+            params.append(periodicity)
+        rollup_conditions, rollup_params = list(conditions), list(params)
+        if start is not None:
+            rollup_conditions.append('day >= ?')
+            rollup_params.append(start.toordinal())
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        rollup_where = ' WHERE ' + ' AND '.join(rollup_conditions) if rollup_conditions else ''
+        cur = self.get_cursor()
+        cur.execute(f'SELECT day, periodicity, completions FROM daily_rollup{rollup_where} ORDER BY day, periodicity',
+                    rollup_params)
+        rows = cur.fetchall()
+        cur.execute(f'SELECT day, periodicity, delta FROM habit_activity{where} ORDER BY day', params)
+        # running totals of the deltas, per periodicity
+        days, totals = {}, {}
+        for day, habit_periodicity, delta in cur.fetchall():
+            periodicity_totals = totals.setdefault(habit_periodicity, [])
+            days.setdefault(habit_periodicity, []).append(day)
+            periodicity_totals.append((periodicity_totals[-1] if periodicity_totals else 0) + delta)
         cur.close()
-        date = date.split('T')[0]
-        return name, date, streak
+
+        def active(day, periodicity):
+            index = bisect.bisect_right(days.get(periodicity, []), day)
+            return totals[periodicity][index - 1] if index else 0
+
+        return [(ordinal_to_iso(day), periodicity, completions, active(day, periodicity)) for day, periodicity, completions in rows]
+
+    def rebuild_daily_rollup(self):
+        """
+        Regenerate the daily rollup from the tracking history in a single transaction.
+
+        Returns:
+        int: The number of rollup rows.
+        """
+        cur = self.get_cursor()
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute('DELETE FROM daily_rollup')
+            cur.execute(DAILY_ROLLUP_V9_BACKFILL)
+            # the rollup is not a table the data_version triggers watch
+            cur.execute('UPDATE data_version SET version = version + 1')
+            cur.execute('SELECT COUNT(*) FROM daily_rollup')
+            count = cur.fetchone()[0]
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        self.invalidate_cache()
+        return count
+
+class ShardManager:
+    """
+    Per-user databases, each in its own SQLite file, with a bounded LRU cache of open shards.
+
+    Evicted shards have their connections closed once no one holds a lease on them, so at most
+    max_open shard files are open at once, plus those still in use.
+    Methods:
+        get: Get the database of a user, opening it if needed.
+        acquire: Get the database of a user and keep it open until released.
+        release: Release a database returned by acquire.
+        set_statement_hook: Set the statement hook of every open shard.
+        close: Close every open shard.
+    """
+
+    def __init__(self, directory, max_open=128, **database_options):
+        """
+        Initialize the shard manager.
+
+        Parameters:
+        directory (str): The directory holding one <user>.db file per user, created if missing.
+        max_open (int): The maximum number of shards kept open.
+        database_options: Passed to Database for every shard.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_open = max_open
+        self.database_options = database_options
+        self._shards = OrderedDict()
+        self._leases = {}
+        self._evicted = set()
+        self._opening = {}
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        """
+        Get the database of a user, opening (and if needed creating) it on first use.
+
+        The database may be closed once evicted; use acquire to keep it open while in use.
+
+        Parameters:
+        user (str): The user ID, made of letters, digits, '-' and '_'.
+
+        Returns:
+        Database: The user's database.
+        """
+        return self._open(user, lease=False)
+
+    def acquire(self, user):
+        """
+        Get the database of a user and keep it open, even if evicted, until it is released.
+
+        Parameters:
+        user (str): The user ID, made of letters, digits, '-' and '_'.
+
+        Returns:
+        Database: The user's database.
+        """
+        return self._open(user, lease=True)
+
+    def release(self, shard):
+        """
+        Release a database returned by acquire, closing it if it was evicted and no one else holds it.
+
+        Parameters:
+        shard (Database): The database.
+        """
+        with self._lock:
+            leases = self._leases.pop(shard, 0) - 1
+            if leases > 0:
+                self._leases[shard] = leases
+                return
+            if shard not in self._evicted:
+                return
+            self._evicted.discard(shard)
+        shard.close()
+
+    def _open(self, user, lease):
+        """
+        Get the database of a user, opening it outside the lock so other users are not held up.
+
+        Parameters:
+        user (str): The user ID.
+        lease (bool): Whether to take a lease on the database.
+
+        Returns:
+        Database: The user's database.
+        """
+        if not SHARD_NAME_PATTERN.fullmatch(user):
+            raise ValueError(f'Invalid user ID: {user!r}')
+        while True:
+            with self._lock:
+                shard = self._shards.get(user)
+                if shard is not None:
+                    self._shards.move_to_end(user)
+                    if lease:
+                        self._leases[shard] = self._leases.get(shard, 0) + 1
+                    return shard
+                opening = self._opening.get(user)
+                if opening is None:
+                    opening = self._opening[user] = threading.Event()
+                    break
+            # another thread is opening this shard: wait for it, then look it up again
+            opening.wait()
+        try:
+            shard = Database(os.path.join(self.directory, f'{user}.db'), **self.database_options)
+            shard.set_statement_hook(_statement_hook)
+        except BaseException:
+            with self._lock:
+                del self._opening[user]
+            opening.set()
+            raise
+        evicted = []
+        with self._lock:
+            del self._opening[user]
+            self._shards[user] = shard
+            if lease:
+                self._leases[shard] = self._leases.get(shard, 0) + 1
+            while len(self._shards) > self.max_open:
+                _, oldest = self._shards.popitem(last=False)
+                if oldest in self._leases:
+                    self._evicted.add(oldest)
+                else:
+                    evicted.append(oldest)
+        opening.set()
+        for oldest in evicted:
+            oldest.close()
+        return shard
+
+    def set_statement_hook(self, hook):
+        """
+        Set the statement hook of every open shard.
+
+        Parameters:
+        hook (callable): Called with the SQL statement and its duration in seconds, or None to remove it.
+        """
+        with self._lock:
+            for shard in [*self._shards.values(), *self._evicted]:
+                shard.set_statement_hook(hook)
+
+    def close(self):
+        """Close every open shard."""
+        with self._lock:
+            for shard in [*self._shards.values(), *self._evicted]:
+                shard.close()
+            self._shards.clear()
+            self._leases.clear()
+            self._evicted.clear()
+
+class AppDatabases:
+    """
+    The databases of one app: its shared database, opened on first use, and optionally its user shards.
+
+    Selected for the current context with use_app_databases, so apps made by a factory each use their
+    own files instead of the process-wide ones.
+    Methods:
+        get: Get the shared database of the app, opening it if needed.
+        close: Close the shared database and every shard of the app.
+    """
+
+    def __init__(self, path=None, shards=None):
+        """
+        Initialize the databases without opening any.
+
+        Parameters:
+        path (str): The SQLite database file, or None for the process-wide database (see configure_database).
+        shards (ShardManager): The user shards of the app, or None for the process-wide ones (see configure_sharding).
+        """
+        self.path = path
+        self.shards = shards
+        self._database = None
+        self._lock = threading.Lock()
+        _app_databases.add(self)
+
+    def get(self):
+        """
+        Get the shared database of the app, opening and migrating it on first use.
+
+        Returns:
+        Database: The shared database.
+        """
+        if self.path is None:
+            return get_database()
+        if self._database is not None:
+            return self._database
+        with self._lock:
+            if self._database is None:
+                database = Database(self.path)
+                database.set_statement_hook(_statement_hook)
+                self._database = database
+        return self._database
+
+    def set_statement_hook(self, hook):
+        """
+        Set the statement hook of every open database of the app.
+
+        Parameters:
+        hook (callable): Called with the SQL statement and its duration in seconds, or None to remove it.
+        """
+        if self._database is not None:
+            self._database.set_statement_hook(hook)
+        if self.shards is not None:
+            self.shards.set_statement_hook(hook)
+
+    def close(self):
+        """Close the shared database and every shard of the app."""
+        with self._lock:
+            if self._database is not None:
+                self._database.close()
+                self._database = None
+        if self.shards is not None:
+            self.shards.close()
+
+class CurrentDatabase:
+    """
+    Stands in for the database of the current user: every attribute is looked up on
+    get_current_database() at the time it is used.
+    Methods:
+        set_statement_hook: Set the statement hook of every database, open or not.
+    """
+
+    def __getattr__(self, name):
+        # private and special names are never forwarded, so introspection (pytest, copy, ...)
+        # doesn't open a database
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_current_database(), name)
+
+    def set_statement_hook(self, hook):
+        """
+        Set the function called after every statement, on every database opened now or later.
+
+        Unlike the other methods, this never opens a database.
+
+        Parameters:
+        hook (callable): Called with the SQL statement and its duration in seconds, or None to remove it.
+        """
+        global _statement_hook
+        _statement_hook = hook
+        if _database is not None:
+            _database.set_statement_hook(hook)
+        if _shards is not None:
+            _shards.set_statement_hook(hook)
+        for databases in list(_app_databases):
+            databases.set_statement_hook(hook)
+
+SHARD_NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+_database = None
+_database_path = None
+_database_lock = threading.Lock()
+_statement_hook = None
+_shards = None
+_current_user = ContextVar('habits_current_user', default=None)
+_current_lease = ContextVar('habits_current_lease', default=None)
+_current_app_databases = ContextVar('habits_current_app_databases', default=None)
+_app_databases = weakref.WeakSet()
+
+def get_database():
+    """
+    Get the database shared by the whole process.
+
+    The database file is the one set with configure_database, else the HABITS_DB_PATH environment
+    variable, else habits.db. It is opened and migrated on first use.
+
+    Returns:
+    Database: The shared database.
+    """
+    global _database
+    if _database is not None:
+        return _database
+    with _database_lock:
+        if _database is None:
+            database = Database(_database_path or os.environ.get('HABITS_DB_PATH', 'habits.db'))
+            database.set_statement_hook(_statement_hook)
+            _database = database
+    return _database
+
+def configure_database(path):
+    """
+    Set the file of the database shared by the whole process.
+
+    If the database is already open it is closed, and the next use opens the new file.
+
+    Parameters:
+    path (str): The path of the SQLite database file, or None for the default.
+    """
+    global _database, _database_path
+    with _database_lock:
+        _database_path = path
+        if _database is not None:
+            _database.close()
+            _database = None
+
+def configure_sharding(directory, max_open=128):
+    """
+    Store every user's data in its own shard, or go back to the single shared database.
+
+    Parameters:
+    directory (str): The directory of the shard files, or None to disable sharding.
+    max_open (int): The maximum number of shards kept open.
+
+    Returns:
+    ShardManager: The new shard manager, or None if sharding was disabled.
+    """
+    global _shards
+    if _shards is not None:
+        _shards.close()
+    _shards = ShardManager(directory, max_open) if directory is not None else None
+    return _shards
+
+def use_app_databases(databases):
+    """
+    Set the databases the current context reads and writes.
+
+    Parameters:
+    databases (AppDatabases): The databases of the current app, or None for the process-wide ones.
+    """
+    _current_app_databases.set(databases)
+
+def get_app_databases():
+    """
+    Get the databases the current context reads and writes.
+
+    Returns:
+    AppDatabases: The databases of the current app, or None for the process-wide ones.
+    """
+    return _current_app_databases.get()
+
+def _current_shards():
+    """
+    Get the shard manager of the current context.
+
+    Returns:
+    ShardManager: The shards of the current app, else the process-wide ones, or None without sharding.
+    """
+    databases = _current_app_databases.get()
+    if databases is not None and databases.shards is not None:
+        return databases.shards
+    return _shards
+
+def _shared_database():
+    """
+    Get the shared database of the current context.
+
+    Returns:
+    Database: The database of the current app, else the process-wide one.
+    """
+    databases = _current_app_databases.get()
+    return databases.get() if databases is not None else get_database()
+
+def set_current_user(user):
+    """
+    Set the user whose shard the current context reads and writes.
+
+    The shard is opened right away, so an invalid user ID raises ValueError here rather than mid-request,
+    and is kept open until the context switches to another user (or None), even if evicted meanwhile.
+
+    Parameters:
+    user (str): The user ID, or None for the shared database.
+    """
+    shards = _current_shards()
+    lease = (shards, shards.acquire(user)) if user is not None and shards is not None else None
+    previous = _current_lease.get()
+    _current_user.set(user)
+    _current_lease.set(lease)
+    if previous is not None:
+        previous[0].release(previous[1])
+
+def get_current_user():
+    """
+    Get the user whose shard the current context reads and writes.
+
+    Returns:
+    str: The user ID, or None for the shared database.
+    """
+    return _current_user.get()
+
+def get_current_database():
+    """
+    Get the database of the current user.
+
+    Returns:
+    Database: The current user's shard, or the shared database (of the current app, if it has its own)
+    if sharding is disabled or no user is set.
+    """
+    user = _current_user.get()
+    shards = _current_shards()
+    if user is None or shards is None:
+        return _shared_database()
+    lease = _current_lease.get()
+    if lease is not None and lease[0] is shards:
+        return lease[1]
+    return shards.get(user)
+
+def acquire_current_database():
+    """
+    Get the database of the current user, kept open until released even if its shard is evicted.
+
+    Use it for work that outlives the current context, such as streamed responses.
+
+    Returns:
+    tuple: The database, and a function to call once done with it.
+    """
+    user = _current_user.get()
+    shards = _current_shards()
+    if user is None or shards is None:
+        return _shared_database(), lambda: None
+    database = shards.acquire(user)
+    return database, functools.partial(shards.release, database)
+
+current_database = CurrentDatabase()
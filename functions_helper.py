@@ -1,80 +1,124 @@
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+from datetime import date, datetime, timedelta
 import random
 from habit import Habit
 import json
 import uuid
+import base64
 
-def day_check(last_updated_at):
+def day_check(last_updated_at, now=None):
     """
     Check if the last updated date is the same as today, one day before today, or earlier.
 
     Parameters:
     last_updated_at (datetime): The last updated date of the habit.
+    now (datetime): The reference date, defaults to the current time.
 
     Returns:
     str: "Same", "Valid Date", or "Streak Expired" based on the date comparison.
     """
-    if last_updated_at.date() == datetime.now().date():
+    today = (now or datetime.now()).date()
+    if last_updated_at.date() == today:
         return "Same"
-    elif last_updated_at.date() + timedelta(days=1) == datetime.now().date():
+    elif last_updated_at.date() + timedelta(days=1) == today:
         return "Valid Date"
-    elif last_updated_at.date() + timedelta(days=1) < datetime.now().date():
+    elif last_updated_at.date() + timedelta(days=1) < today:
         return "Streak Expired"
 
-def week_check(last_updated_at):
+def week_check(last_updated_at, now=None):
     """
     Check if the last updated date is the same week as today, one week before today, or earlier.
 
     Parameters:
     last_updated_at (datetime): The last updated date of the habit.
+    now (datetime): The reference date, defaults to the current time.
 
     Returns:
     str: "Same", "Valid", or "Streak Expired" based on the date comparison.
     """
-    if last_updated_at.isocalendar()[1] == datetime.now().isocalendar()[1] and last_updated_at.year == datetime.now().year:
+    now = now or datetime.now()
+    current_week = now.isocalendar()[1]
+    if last_updated_at.isocalendar()[1] == current_week and last_updated_at.year == now.year:
         return "Same"
-    elif last_updated_at.isocalendar()[1] + 1 == datetime.now().isocalendar()[1] and last_updated_at.year == datetime.now().year:
+    elif last_updated_at.isocalendar()[1] + 1 == current_week and last_updated_at.year == now.year:
         return "Valid"
-    elif last_updated_at.isocalendar()[1] + 1 < datetime.now().isocalendar()[1] and last_updated_at.year == datetime.now().year:
+    elif last_updated_at.isocalendar()[1] + 1 < current_week and last_updated_at.year == now.year:
         return "Streak Expired"
 
-def month_check(last_updated_at):
+def month_check(last_updated_at, now=None):
     """
     Check if the last updated date is the same month as today, one month before today, or earlier.
 
     Parameters:
     last_updated_at (datetime): The last updated date of the habit.
+    now (datetime): The reference date, defaults to the current time.
 
     Returns:
     str: "Same", "Valid", or "Streak Expired" based on the date comparison.
     """
-    if last_updated_at.month == datetime.now().month and last_updated_at.year == datetime.now().year:
+    now = now or datetime.now()
+    if last_updated_at.month == now.month and last_updated_at.year == now.year:
         return "Same"
-    elif last_updated_at.month + 1 == datetime.now().month + 1 and last_updated_at.year == datetime.now().year:
+    elif last_updated_at.month + 1 == now.month + 1 and last_updated_at.year == now.year:
         return "Valid"
-    elif last_updated_at.month > datetime.now().month + 1 and last_updated_at.year == datetime.now().year:
+    elif last_updated_at.month > now.month + 1 and last_updated_at.year == now.year:
         return "Streak Expired"
 
-def date_check_with_periodicity(periodicity, last_updated_at):
+PERIODICITY_CHECKS = {'D': day_check, 'W': week_check, 'M': month_check}
+
+def date_check_with_periodicity(periodicity, last_updated_at, now=None):
     """
     Check the date with respect to the given periodicity.
 
     Parameters:
     periodicity (str): The periodicity of the habit ('D', 'W', 'M').
     last_updated_at (datetime): The last updated date of the habit.
+    now (datetime): The reference date, defaults to the current time.
 
     Returns:
     str: The status of the habit based on the date check.
     """
     if not isinstance(last_updated_at, datetime):
         last_updated_at = datetime.fromisoformat(last_updated_at)
-    if periodicity == 'D':
-        return day_check(last_updated_at)
-    elif periodicity == 'W':
-        return week_check(last_updated_at)
-    elif periodicity == 'M':
-        return month_check(last_updated_at)
+    check = PERIODICITY_CHECKS.get(periodicity)
+    if check:
+        return check(last_updated_at, now)
+
+def bulk_date_check_with_periodicity(habits, now=None):
+    """
+    Check the dates of many habits in one pass.
+
+    All checks share the same reference date, and each distinct (periodicity, date) pair
+    is parsed and checked only once.
+
+    Parameters:
+    habits (list): A list of (periodicity, last_updated_at) pairs; dates may be datetimes, ISO strings or day ordinals.
+    now (datetime): The reference date, defaults to the current time.
+
+    Returns:
+    list: The status of each habit, in the same order as the input.
+    """
+    now = now or datetime.now()
+    by_periodicity = {}
+    for index, (periodicity, last_updated_at) in enumerate(habits):
+        by_periodicity.setdefault(periodicity, []).append((index, last_updated_at))
+
+    statuses = [None] * len(habits)
+    for periodicity, entries in by_periodicity.items():
+        check = PERIODICITY_CHECKS.get(periodicity)
+        if check is None:
+            continue
+        checked = {}
+        for index, last_updated_at in entries:
+            if last_updated_at not in checked:
+                if isinstance(last_updated_at, datetime):
+                    parsed = last_updated_at
+                elif isinstance(last_updated_at, int):
+                    parsed = datetime.fromordinal(last_updated_at)
+                else:
+                    parsed = datetime.fromisoformat(last_updated_at)
+                checked[last_updated_at] = check(parsed, now)
+            statuses[index] = checked[last_updated_at]
+    return statuses
 
 def check_max_streak(periodicity, created_at, last_updated_at):
     """
@@ -100,6 +144,7 @@ def create_initial_habits():
     with open('test_data/predefined_habits.json', 'r') as f:
         predefined_habits = json.load(f)
 
+    habits = []
     for habit_data in predefined_habits:
         last_updated_at = datetime.now() - timedelta(days=random.randint(1, 10))
         created_at = last_updated_at - timedelta(days=random.randint(365, 730))
@@ -119,10 +164,6 @@ def create_initial_habits():
             streak=streak,
             last_updated_at=last_updated_at
         )
-        success = habit.create_habit()
-        if not success:
-            print(f"Habit {habit_data['name']} already exists.")
-            continue
         dates = generate_random_habit_tracking_dates(
             periodicity=habit_data["periodicity"],
             created_at=created_at,
@@ -131,8 +172,8 @@ def create_initial_habits():
             success_rate=habit_data["success_rate"]
         )
         print(f"Generating {len(dates)} random dates of tracking data for habit {habit_data['name']}")
-        for date in dates:
-            habit.mark_habit_as_completed(write_date=datetime.fromisoformat(date), is_fake_tracking_data=True)
+        habits.append((habit, [datetime.fromisoformat(date) for date in dates]))
+    Habit().bulk_create_habits(habits)
 
 def generate_random_habit_tracking_dates(periodicity, created_at, streak, last_updated_at, success_rate=0.8):
     """
@@ -148,6 +189,8 @@ def generate_random_habit_tracking_dates(periodicity, created_at, streak, last_u
     Returns:
     list: A list of dates when the habit was tracked.
     """
+    # imported here so importing the helpers (and the app) doesn't pay for dateutil
+    from dateutil.relativedelta import relativedelta
     if periodicity == 'D':
         diff = (last_updated_at - created_at).days
         dates_list = [(created_at + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(diff + 1)]
@@ -194,48 +237,75 @@ def generate_random_habit_tracking_dates(periodicity, created_at, streak, last_u
 
     return dates_list
 
-def generate_tracking_data_dict(tracking_data, periodicity):
+def generate_tracking_bitmaps(tracking_data, periodicity):
     """
-    Generate a dictionary of tracking data based on periodicity.
+    Generate one bitmap per year of tracking data based on periodicity.
+
+    Each bitmap is a bytearray with one 0/1 byte per day of the year. Weekly and monthly
+    habits mark their whole week or month, filled with slice assignment.
 
     Parameters:
-    tracking_data (list): A list of tracking dates.
+    tracking_data (list): A list of tracking dates, as date objects or 'YYYY-MM-DD' strings.
     periodicity (str): The periodicity of the habit ('D', 'W', 'M').
 
     Returns:
-    dict: A dictionary with years as keys and tracking data as values.
+    dict: A dictionary with years as keys and bitmaps as values.
     """
-    dates = [datetime.strptime(date, '%Y-%m-%d') for date in tracking_data]
-    
-    tracking_dict = {}
-    for date in dates:
-        year = date.year
-        if year not in tracking_dict:
+    bitmaps = {}
+    year_starts = {}
+    month_starts = {}
+    for tracked in tracking_data:
+        day = tracked if isinstance(tracked, date) else date.fromisoformat(tracked)
+        year = day.year
+        if year not in bitmaps:
             is_leap_year = (year % 4 == 0 and year % 100 != 0) or (year % 400 == 0)
-            days_in_year = 366 if is_leap_year else 365
-            tracking_dict[year] = [0] * days_in_year
-    
-    for date in dates:
-        year = date.year
-        start_of_year = datetime(year, 1, 1)
-        day_of_year = (date - start_of_year).days
-        
+            bitmaps[year] = bytearray(366 if is_leap_year else 365)
+            year_starts[year] = date(year, 1, 1).toordinal()
+            month_starts[year] = [date(year, month, 1).toordinal() - year_starts[year] for month in range(1, 13)] + [len(bitmaps[year])]
+        bitmap = bitmaps[year]
+        day_of_year = day.toordinal() - year_starts[year]
+
         if periodicity == 'D':
-            tracking_dict[year][day_of_year] = 1
+            bitmap[day_of_year] = 1
         elif periodicity == 'W':
-            start_of_week = date - timedelta(days=date.weekday())
-            end_of_week = start_of_week + timedelta(days=6)
-            for i in range((start_of_week - start_of_year).days, (end_of_week - start_of_year).days + 1):
-                if 0 <= i < len(tracking_dict[year]):
-                    tracking_dict[year][i] = 1
+            start = max(day_of_year - day.weekday(), 0)
+            end = min(day_of_year - day.weekday() + 7, len(bitmap))
+            bitmap[start:end] = b'\x01' * (end - start)
         elif periodicity == 'M':
-            start_of_month = datetime(year, date.month, 1)
-            if date.month == 12:
-                end_of_month = datetime(year + 1, 1, 1) - timedelta(days=1)
-            else:
-                end_of_month = datetime(year, date.month + 1, 1) - timedelta(days=1)
-            for i in range((start_of_month - start_of_year).days, (end_of_month - start_of_year).days + 1):
-                if 0 <= i < len(tracking_dict[year]):
-                    tracking_dict[year][i] = 1
-    
-    return tracking_dict
+            start, end = month_starts[year][day.month - 1], month_starts[year][day.month]
+            bitmap[start:end] = b'\x01' * (end - start)
+    return bitmaps
+
+def generate_tracking_data_dict(tracking_data, periodicity):
+    """
+    Generate a dictionary of tracking data based on periodicity.
+
+    Parameters:
+    tracking_data (list): A list of tracking dates.
+    periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+
+    Returns:
+    dict: A dictionary with years as keys and tracking data as values.
+    """
+    return {year: list(bitmap) for year, bitmap in generate_tracking_bitmaps(tracking_data, periodicity).items()}
+
+BITMAP_TO_BINARY_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+def encode_tracking_bitset(bitmaps):
+    """
+    Encode tracking bitmaps as compact base64 bitsets.
+
+    Day N of the year is bit (7 - N % 8) of byte N // 8, so a year fits in 46 bytes.
+
+    Parameters:
+    bitmaps (dict): A dictionary with years as keys and bitmaps as values.
+
+    Returns:
+    dict: A dictionary with years as keys and base64 strings as values.
+    """
+    encoded = {}
+    for year, bitmap in bitmaps.items():
+        bits = bitmap.translate(BITMAP_TO_BINARY_DIGITS)
+        bits += b'0' * (-len(bits) % 8)
+        encoded[year] = base64.b64encode(int(bits, 2).to_bytes(len(bits) // 8, 'big')).decode('ascii')
+    return encoded
@@ -1,8 +1,11 @@
-from db import Database
-from datetime import datetime
+import sqlite3
+from db import current_database, normalize_name, ordinal_to_iso
+from records import PERIODICITY_NAMES, habits_to_json
+from repository import HabitRepository
+from datetime import date, datetime
 from typing import Optional
 
-db = Database()
+db = current_database
 
 class Habit:
     """
@@ -18,14 +21,22 @@ class Habit:
 
     Methods:
         create_habit: Create a new habit in the database.
+        bulk_create_habits: Create many habits and their tracking data in one transaction.
         delete_habit: Delete the habit from the database.
         mark_habit_as_completed: Mark the habit as completed.
+        record_completions: Mark habits as completed in one transaction.
+        mark_habits_as_completed: Mark many habits as completed on many dates in one transaction.
+        _apply_completions: Add completions and update streaks, with the rule every write path follows.
         get_all_habits: Get all habits from the database.
+        iter_habit_batches: Iterate over habits a batch at a time.
         get_habit_from_name: Get a habit by name.
         longest_daily_streak: Get the longest daily streak.
         longest_weekly_streak: Get the longest weekly streak.
         longest_monthly_streak: Get the longest monthly streak.
         get_tracking_data: Get tracking data for the habit.
+        _streak_start: Find the date the current streak started.
+        _period: Number the period a day falls in.
+        _streak_from_ordinals: Compute the current streak from the completion dates.
         _format_periodicity: Format periodicity to a readable format.
         _longest_streak: Get the longest streak based on periodicity.
 
@@ -60,53 +71,212 @@ class Habit:
             print(f"Habit {self.name} already exists.")
             return False
         cur = db.get_cursor()
-        cur.execute('INSERT INTO habits (id, name, periodicity, created_at, streak, last_updated_at) VALUES (?, ?, ?, ?, ?, ?)', 
-                    (self.habit_id, self.name.title(), self.periodicity, self.created_at.isoformat(), self.streak, self.last_updated_at.isoformat()))
+        cur.execute('INSERT INTO habits (id, name, periodicity, created_at, streak, last_updated_at, normalized_name) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                    (self.habit_id, self.name.title(), self.periodicity, self.created_at.toordinal(), self.streak, self.last_updated_at.toordinal(), normalize_name(self.name)))
         db.conn.commit()
         cur.close()
+        db.invalidate_cache(self.name)
         print(f"Created habit {self.name} with periodicity {self.periodicity}")
         return True
 
+    def bulk_create_habits(self, habits):
+        """
+        Create many habits and their tracking data in one transaction.
+
+        Parameters:
+        habits (list): A list of (Habit, dates) pairs, where dates are the datetimes the habit was completed.
+
+        Returns:
+        list: The habits that were created. Habits that already exist are skipped.
+        """
+        created = []
+        names = set()
+        for habit, dates in habits:
+            if normalize_name(habit.name) in names or db.habit_exists(habit.name):
+                print(f"Habit {habit.name} already exists.")
+                continue
+            names.add(normalize_name(habit.name))
+            created.append((habit, dates))
+        habit_rows = [(habit.habit_id, habit.name, habit.periodicity, habit.created_at.toordinal(), habit.streak, habit.last_updated_at.toordinal(), self._streak_start(habit.streak, dates)) for habit, dates in created]
+        tracking_rows = ((habit.habit_id, day.toordinal()) for habit, dates in created for day in dates)
+        db.bulk_insert(habit_rows, tracking_rows)
+        for habit, dates in created:
+            print(f"Created habit {habit.name} with periodicity {habit.periodicity} and {len(dates)} tracking dates")
+        return [habit for habit, _ in created]
+
     def delete_habit(self):
         """Delete the habit from the database."""
         cur = db.get_cursor()
-        cur.execute('DELETE FROM habits WHERE id = ?', (self.habit_id,))
+        # tracking first, so the daily rollup triggers can still read the habit's periodicity
         cur.execute('DELETE FROM habit_tracking WHERE habit_id = ?', (self.habit_id,))
+        cur.execute('DELETE FROM habits WHERE id = ?', (self.habit_id,))
         db.conn.commit()
         cur.close()
+        db.invalidate_cache(self.name)
         print(f"Deleted habit {self.name}")
 
-    def mark_habit_as_completed(self, write_date: Optional[datetime] = datetime.now(), is_fake_tracking_data: bool = False):
+    def mark_habit_as_completed(self, write_date: Optional[datetime] = None, is_fake_tracking_data: bool = False):
         """
-        Mark the habit as completed.
+        Mark the habit as completed, updating its streak with the rule of _apply_completions.
 
         Parameters:
-        write_date (datetime): The date the habit was completed.
-        is_fake_tracking_data (bool): If True, do not update the streak.
+        write_date (datetime): The date the habit was completed, defaults to today.
+        is_fake_tracking_data (bool): If True, only add the tracking row and do not update the streak.
         """
+        write_date = write_date or datetime.now()
         cur = db.get_cursor()
-        if not is_fake_tracking_data:
-            cur.execute('UPDATE habits SET streak = streak + 1, last_updated_at = ? WHERE id = ?', 
-                        (write_date.isoformat(), self.habit_id))
-        cur.execute('INSERT INTO habit_tracking VALUES(?, ?)', (self.habit_id, write_date.isoformat()))
-        db.conn.commit()
-        cur.close()
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            if is_fake_tracking_data:
+                cur.execute('INSERT INTO habit_tracking VALUES(?, ?)', (self.habit_id, write_date.toordinal()))
+            else:
+                self._apply_completions(cur, {self.habit_id: [write_date.toordinal()]})
+            db.conn.commit()
+        except sqlite3.Error:
+            db.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        db.invalidate_cache(self.name)
         if not is_fake_tracking_data:
             print(f"Marked habit {self.name} as completed")
 
-    def get_all_habits(self):
+    def record_completions(self, completions):
         """
-        Get all habits from the database.
+        Mark habits as completed in a single transaction, with the rule of _apply_completions.
+
+        Parameters:
+        completions (list): The (habit ID, date) pairs to mark, in order. Completions of habits
+        that no longer exist are skipped.
+        """
+        ordinals = {}
+        for habit_id, day in completions:
+            ordinals.setdefault(habit_id, []).append(day.toordinal())
+        cur = db.get_cursor()
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            self._apply_completions(cur, ordinals)
+            db.conn.commit()
+        except sqlite3.Error:
+            db.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        db.invalidate_cache()
+        print(f"Marked {len(completions)} completions")
+
+    def mark_habits_as_completed(self, completions):
+        """
+        Mark many habits as completed on many dates in a single transaction, with the rule of
+        _apply_completions.
+
+        Parameters:
+        completions (dict): The dates (as date objects) to mark, keyed by habit ID.
 
         Returns:
-        list: A list of all habits.
+        dict: The new streak of each habit, keyed by habit ID. Habits that no longer exist are left out.
         """
         cur = db.get_cursor()
-        cur.execute('SELECT * FROM habits ORDER BY id ASC')
-        habits = cur.fetchall()
-        cur.close()
-        formatted_habits = [(habit_id, name, self._format_periodicity(periodicity), created_at.split('T')[0], streak, last_updated_at.split('T')[0]) for habit_id, name, periodicity, created_at, streak, last_updated_at in habits]
-        return formatted_habits
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            streaks, marked = self._apply_completions(
+                cur, {habit_id: [day.toordinal() for day in dates] for habit_id, dates in completions.items()})
+            db.conn.commit()
+        except sqlite3.Error:
+            db.conn.rollback()
+            raise
+        finally:
+            cur.close()
+        db.invalidate_cache()
+        print(f"Marked {marked} completions for {len(completions)} habits")
+        return streaks
+
+    def _apply_completions(self, cur, completions, today=None):
+        """
+        Add completions and update the streaks of their habits, inside the caller's transaction.
+
+        Every write path follows this rule. The streak is the number of consecutive periods (days,
+        ISO weeks or months), ending at the latest completion, in which the habit was completed;
+        it is 0, with no start date, unless that run reaches the current or the previous period.
+        Completing a habit again within a period does not change it, and dates already tracked are
+        skipped. last_updated_at is the latest completion.
+
+        Completions after the latest tracked one extend the stored streak, so marking today is a
+        few index lookups; earlier ones (backfills) recount it from the tracking history.
+
+        Parameters:
+        cur (sqlite3.Cursor): A cursor inside a write transaction.
+        completions (dict): The completion dates as day ordinals, keyed by habit ID.
+        today (date): The reference date, defaults to today.
+
+        Returns:
+        tuple: The new streak of each existing habit, keyed by habit ID, and the number of tracking rows added.
+        """
+        today = (today or date.today()).toordinal()
+        streaks, tracking_rows, habit_rows = {}, [], []
+        for habit_id, ordinals in completions.items():
+            cur.execute('SELECT periodicity, streak, streak_started_at FROM habits WHERE id = ?', (habit_id,))
+            habit = cur.fetchone()
+            if habit is None:
+                continue
+            periodicity, streak, streak_started_at = habit
+            ordinals = sorted(set(ordinals))
+            cur.execute('SELECT MAX(marked_date) FROM habit_tracking WHERE habit_id = ?', (habit_id,))
+            latest = cur.fetchone()[0]
+            if streak and latest is not None and latest <= ordinals[0]:
+                marked = [ordinal for ordinal in ordinals if ordinal != latest]
+                for ordinal in marked:
+                    gap = self._period(periodicity, ordinal) - self._period(periodicity, latest)
+                    if gap == 1:
+                        streak += 1
+                    elif gap > 1:
+                        streak, streak_started_at = 1, ordinal
+                    latest = ordinal
+            else:
+                cur.execute('SELECT marked_date FROM habit_tracking WHERE habit_id = ?', (habit_id,))
+                tracked = {row[0] for row in cur.fetchall()}
+                marked = [ordinal for ordinal in ordinals if ordinal not in tracked]
+                tracked.update(marked)
+                streak, streak_started_at = self._streak_from_ordinals(periodicity, sorted(tracked))
+                latest = max(tracked)
+            if self._period(periodicity, latest) < self._period(periodicity, today) - 1:
+                streak, streak_started_at = 0, None
+            tracking_rows.extend((habit_id, ordinal) for ordinal in marked)
+            habit_rows.append((streak, latest, streak_started_at, habit_id))
+            streaks[habit_id] = streak
+        cur.executemany('INSERT INTO habit_tracking (habit_id, marked_date) VALUES (?, ?)', tracking_rows)
+        cur.executemany('UPDATE habits SET streak = ?, last_updated_at = ?, streak_started_at = ? WHERE id = ?', habit_rows)
+        return streaks, len(tracking_rows)
+
+    def get_all_habits(self, periodicity=None, after=None, limit=None):
+        """
+        Get all habits from the database.
+
+        Parameters:
+        periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+        after (str): Only return habits whose ID sorts after this one (keyset pagination).
+        limit (int): The maximum number of habits to return.
+
+        Returns:
+        list: A list of all habits, in the JSON shape of the API.
+        """
+        return habits_to_json(HabitRepository(db).get_habits(periodicity, after, limit))
+
+    def iter_habit_batches(self, periodicity=None, after=None, limit=None, batch_size=500):
+        """
+        Iterate over habits in ID order, a batch at a time, without loading every row.
+
+        Parameters:
+        periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+        after (str): Only return habits whose ID sorts after this one (keyset pagination).
+        limit (int): The maximum number of habits to return.
+        batch_size (int): The number of rows fetched from the cursor per batch.
+
+        Yields:
+        list: The next batch of habits, in the JSON shape of the API.
+        """
+        for batch in HabitRepository(db).iter_habit_batches(periodicity, after, limit, batch_size):
+            yield habits_to_json(batch)
 
     def get_habit_from_name(self):
         """
@@ -115,13 +285,10 @@ class Habit:
         Returns:
         tuple: The habit data.
         """
-        cur = db.get_cursor()
-        cur.execute("SELECT * FROM habits WHERE LOWER(name) LIKE ?", (f"%{self.name.lower()}%",))
-        habit = cur.fetchone()
-        cur.close()
+        habit = db.get_habit_by_name(self.name)
         if habit:
             self.habit_id, self.name, self.periodicity, self.created_at, self.streak, self.last_updated_at = habit
-            return (self.habit_id, self.name, self._format_periodicity(self.periodicity), self.created_at.split('T')[0], self.streak, self.last_updated_at.split('T')[0])
+            return (self.habit_id, self.name, self._format_periodicity(self.periodicity), ordinal_to_iso(self.created_at), self.streak, ordinal_to_iso(self.last_updated_at))
         return None
 
     def longest_daily_streak(self):
@@ -167,22 +334,89 @@ class Habit:
         cur.close()
         return longest_streak
 
-    def get_tracking_data(self):
+    def get_tracking_data(self, start=None, end=None):
         """
         Get tracking data for the habit.
 
+        Parameters:
+        start (date): Only return dates on or after this day.
+        end (date): Only return dates on or before this day.
+
         Returns:
-        tuple: The tracking data and periodicity.
+        tuple: The tracking dates (as date objects) and periodicity.
         """
+        conditions, params = '', []
+        if start is not None:
+            conditions += ' AND ht.marked_date >= ?'
+            params.append(start.toordinal())
+        if end is not None:
+            conditions += ' AND ht.marked_date <= ?'
+            params.append(end.toordinal())
         cur = db.get_cursor()
-        cur.execute('SELECT marked_date FROM habit_tracking WHERE habit_id = ? ORDER BY marked_date ASC', (self.habit_id,))
-        tracking_data = [date[0].split('T')[0] for date in cur.fetchall()]
+        cur.execute(f'SELECT h.periodicity, ht.marked_date FROM habits h LEFT JOIN habit_tracking ht ON ht.habit_id = h.id{conditions} WHERE h.id = ? ORDER BY ht.marked_date ASC', 
+                    (*params, self.habit_id))
+        rows = cur.fetchall()
         cur.close()
-        cur = db.get_cursor()
-        cur.execute('SELECT periodicity FROM habits WHERE id = ?', (self.habit_id,))
-        periodicity = cur.fetchone()[0]
+        periodicity = rows[0][0] if rows else None
+        tracking_data = [date.fromordinal(marked_date) for _, marked_date in rows if marked_date is not None]
         return tracking_data, periodicity
 
+    def _streak_start(self, streak, dates):
+        """
+        Find the date the current streak started from the completion dates.
+
+        Parameters:
+        streak (int): The current streak of the habit.
+        dates (list): The datetimes the habit was completed.
+
+        Returns:
+        int: The start date of the streak as a day ordinal, or None if there is no active streak.
+        """
+        if streak <= 0 or streak > len(dates):
+            return None
+        return sorted(dates)[-streak].toordinal()
+
+    def _period(self, periodicity, ordinal):
+        """
+        Number the period a day falls in, so consecutive periods get consecutive numbers.
+
+        Parameters:
+        periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+        ordinal (int): The day as a day ordinal.
+
+        Returns:
+        int: The number of the day, ISO week or month.
+        """
+        if periodicity == 'W':
+            # day ordinal 1 is a Monday, so this numbers ISO weeks consecutively
+            return (ordinal - 1) // 7
+        if periodicity == 'M':
+            day = date.fromordinal(ordinal)
+            return day.year * 12 + day.month
+        return ordinal
+
+    def _streak_from_ordinals(self, periodicity, ordinals):
+        """
+        Count the consecutive periods, ending at the latest completion, in which the habit was completed.
+
+        Parameters:
+        periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+        ordinals (list): The completion dates as sorted day ordinals.
+
+        Returns:
+        tuple: The streak, and the first completion of the streak as a day ordinal (None without completions).
+        """
+        streak, streak_started_at, current = 0, None, None
+        for ordinal in reversed(ordinals):
+            key = self._period(periodicity, ordinal)
+            if current is None or key == current - 1:
+                streak += 1
+                current = key
+            elif key != current:
+                break
+            streak_started_at = ordinal
+        return streak, streak_started_at
+
     def _format_periodicity(self, periodicity):
         """
         Format periodicity to a readable format.
@@ -193,4 +427,4 @@ class Habit:
         Returns:
         str: The formatted periodicity.
         """
-        return {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}.get(periodicity, periodicity)
+        return PERIODICITY_NAMES.get(periodicity, periodicity)
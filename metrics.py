@@ -0,0 +1,196 @@
+import contextvars
+import threading
+import time
+from flask import Response, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """
+    A Prometheus-style histogram with cumulative buckets.
+    Methods:
+        observe: Record a value.
+    """
+
+    def __init__(self, buckets):
+        """
+        Initialize the histogram.
+
+        Parameters:
+        buckets (tuple): The upper bounds of the buckets, in increasing order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Record a value.
+
+        Parameters:
+        value (float): The value to record.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+class RequestStats:
+    """The measurements of one request in flight."""
+
+    __slots__ = ('started_at', 'queries', 'query_seconds')
+
+    def __init__(self):
+        """Start measuring a request."""
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+
+# A context variable rather than a thread-local, so statements run on executor threads on
+# behalf of a request (see async_store.py) are counted against it.
+_current_request = contextvars.ContextVar('current_request', default=None)
+
+class Metrics:
+    """
+    Per-route request latency and SQL statement metrics, exposed in Prometheus text format.
+    Methods:
+        record_statement: Count a statement against the current request.
+        start_request: Start measuring the current request.
+        finish_request: Record the current request.
+        render: Render every metric in Prometheus text format.
+    """
+
+    def __init__(self):
+        """Initialize empty metrics."""
+        self._lock = threading.Lock()
+        self.request_latency = {}
+        self.request_queries = {}
+        self.query_seconds = {}
+
+    def record_statement(self, sql, duration):
+        """
+        Count a statement against the request running in this context, if any.
+
+        Parameters:
+        sql (str): The SQL statement.
+        duration (float): How long the statement took, in seconds.
+        """
+        stats = _current_request.get()
+        if stats is None:
+            return
+        stats.queries += 1
+        stats.query_seconds += duration
+
+    def start_request(self):
+        """Start measuring the request running in this context."""
+        _current_request.set(RequestStats())
+
+    def finish_request(self, method, route, status):
+        """
+        Record the request running in this context.
+
+        Parameters:
+        method (str): The HTTP method.
+        route (str): The URL rule that matched, e.g. '/habits/<string:name>'.
+        status (int): The response status code.
+        """
+        stats = _current_request.get()
+        if stats is None:
+            return
+        latency = time.perf_counter() - stats.started_at
+        _current_request.set(None)
+        with self._lock:
+            self.request_latency.setdefault((method, route, str(status)), Histogram(LATENCY_BUCKETS)).observe(latency)
+            self.request_queries.setdefault((method, route), Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+            self.query_seconds[(method, route)] = self.query_seconds.get((method, route), 0.0) + stats.query_seconds
+
+    def render(self):
+        """
+        Render every metric in Prometheus text format.
+
+        Returns:
+        str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'habit_tracker_request_duration_seconds', 'Request latency by route.', ('method', 'route', 'status'), self.request_latency)
+            self._render_histograms(lines, 'habit_tracker_request_queries', 'SQL statements run per request by route.', ('method', 'route'), self.request_queries)
+            lines.append('# HELP habit_tracker_query_duration_seconds_total Time spent in SQL statements by route.')
+            lines.append('# TYPE habit_tracker_query_duration_seconds_total counter')
+            for key, seconds in sorted(self.query_seconds.items()):
+                lines.append(f'habit_tracker_query_duration_seconds_total{{{_labels(("method", "route"), key)}}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, lines, name, description, label_names, histograms):
+        """
+        Render a family of histograms.
+
+        Parameters:
+        lines (list): The output lines, appended to.
+        name (str): The metric name.
+        description (str): The HELP text.
+        label_names (tuple): The names of the labels in each key.
+        histograms (dict): The histograms, keyed by label values.
+        """
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, histogram in sorted(histograms.items()):
+            labels = _labels(label_names, key)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+def _labels(names, values):
+    """
+    Format Prometheus label pairs.
+
+    Parameters:
+    names (tuple): The label names.
+    values (tuple): The label values.
+
+    Returns:
+    str: The label pairs, e.g. 'method="GET",route="/habits"'.
+    """
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+def init_metrics(app, database):
+    """
+    Instrument an app and its database and expose the metrics at /metrics.
+
+    Parameters:
+    app (Flask): The Flask app.
+    database (Database): The database whose statements are counted.
+
+    Returns:
+    Metrics: The metrics of the app.
+    """
+    metrics = Metrics()
+    database.set_statement_hook(metrics.record_statement)
+
+    @app.before_request
+    def start_request_metrics():
+        metrics.start_request()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.finish_request(request.method, route, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """
+        Get request and SQL metrics in Prometheus text format.
+
+        Returns:
+        text: The metrics.
+        """
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
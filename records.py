@@ -0,0 +1,78 @@
+from db import ordinal_to_iso
+
+PERIODICITY_NAMES = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly'}
+
+class HabitRecord:
+    """
+    A row of the habits table, with dates as day ordinals.
+
+    Attributes:
+        id (str): The ID of the habit.
+        name (str): The name of the habit.
+        periodicity (str): The periodicity of the habit ('D', 'W', 'M').
+        created_at (int): The creation date.
+        streak (int): The current streak.
+        last_updated_at (int): The date the habit was last completed.
+        streak_started_at (int): The date the current streak started, or None.
+    Methods:
+        to_json: Get the habit in the JSON shape of the API.
+    """
+    __slots__ = ('id', 'name', 'periodicity', 'created_at', 'streak', 'last_updated_at', 'streak_started_at')
+
+    def __init__(self, id, name, periodicity, created_at, streak, last_updated_at, streak_started_at=None):
+        self.id = id
+        self.name = name
+        self.periodicity = periodicity
+        self.created_at = created_at
+        self.streak = streak
+        self.last_updated_at = last_updated_at
+        self.streak_started_at = streak_started_at
+
+    def to_json(self):
+        """
+        Get the habit in the JSON shape of the API.
+
+        Returns:
+        list: [id, name, periodicity name, created_at, streak, last_updated_at], with ISO dates.
+        """
+        return [self.id, self.name, PERIODICITY_NAMES.get(self.periodicity, self.periodicity),
+                ordinal_to_iso(self.created_at), self.streak, ordinal_to_iso(self.last_updated_at)]
+
+class TrackingRecord:
+    """
+    A row of the habit_tracking table.
+
+    Attributes:
+        habit_id (str): The ID of the habit.
+        marked_date (int): The date the habit was completed, as a day ordinal.
+    """
+    __slots__ = ('habit_id', 'marked_date')
+
+    def __init__(self, habit_id, marked_date):
+        self.habit_id = habit_id
+        self.marked_date = marked_date
+
+def habit_record_factory(cursor, row):
+    """sqlite3 row factory that hydrates HabitRecord objects."""
+    return HabitRecord(*row)
+
+def tracking_record_factory(cursor, row):
+    """sqlite3 row factory that hydrates TrackingRecord objects."""
+    return TrackingRecord(*row)
+
+def habits_to_json(habits, statuses=None):
+    """
+    Serialize habit records to the JSON shape of the API.
+
+    Every listing (JSON, NDJSON, sync or async) goes through here.
+
+    Parameters:
+    habits (list): The HabitRecord objects.
+    statuses (list): The marked status of each habit, appended to its row, or None.
+
+    Returns:
+    list: One list per habit.
+    """
+    if statuses is None:
+        return [habit.to_json() for habit in habits]
+    return [habit.to_json() + [status] for habit, status in zip(habits, statuses)]
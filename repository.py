@@ -0,0 +1,106 @@
+from db import current_database
+from records import HabitRecord, habit_record_factory, tracking_record_factory
+
+HABIT_COLUMNS = 'id, name, periodicity, created_at, streak, last_updated_at, streak_started_at'
+
+class HabitRepository:
+    """
+    Reads habits and tracking rows as HabitRecord and TrackingRecord objects, hydrated by
+    sqlite3 row factories, so no Habit has to be built just to run a query.
+    Methods:
+        iter_habit_batches: Iterate over habits a batch at a time.
+        get_habits: Get habits, optionally filtered and paginated.
+        get_habit: Get a habit by name.
+        iter_tracking: Iterate over tracking rows a batch at a time.
+    """
+
+    def __init__(self, database=current_database):
+        """
+        Initialize the repository.
+
+        Parameters:
+        database (Database): The database to read, by default the current user's.
+        """
+        self.database = database
+
+    def iter_habit_batches(self, periodicity=None, after=None, limit=None, batch_size=500):
+        """
+        Iterate over habits in ID order, a batch at a time, without loading every row.
+
+        Parameters:
+        periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+        after (str): Only return habits whose ID sorts after this one (keyset pagination).
+        limit (int): The maximum number of habits to return.
+        batch_size (int): The number of rows fetched from the cursor per batch.
+
+        Yields:
+        list: The next batch of HabitRecord objects.
+        """
+        query = f'SELECT {HABIT_COLUMNS} FROM habits'
+        conditions, params = [], []
+        if periodicity:
+            conditions.append('periodicity = ?')
+            params.append(periodicity)
+        if after:
+            conditions.append('id > ?')
+            params.append(after)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id ASC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        cur = self.database.get_cursor()
+        cur.row_factory = habit_record_factory
+        try:
+            cur.execute(query, params)
+            while habits := cur.fetchmany(batch_size):
+                yield habits
+        finally:
+            cur.close()
+
+    def get_habits(self, periodicity=None, after=None, limit=None):
+        """
+        Get habits in ID order.
+
+        Parameters:
+        periodicity (str): Only return habits with this periodicity ('D', 'W', 'M').
+        after (str): Only return habits whose ID sorts after this one (keyset pagination).
+        limit (int): The maximum number of habits to return.
+
+        Returns:
+        list: The HabitRecord objects.
+        """
+        return [habit for batch in self.iter_habit_batches(periodicity, after, limit) for habit in batch]
+
+    def get_habit(self, name):
+        """
+        Get a habit by its exact name, through the habit cache.
+
+        Parameters:
+        name (str): The name of the habit.
+
+        Returns:
+        HabitRecord: The habit, or None if it does not exist.
+        """
+        habit = self.database.get_habit_by_name(name)
+        return HabitRecord(*habit) if habit is not None else None
+
+    def iter_tracking(self, batch_size=1000):
+        """
+        Iterate over every tracking row, ordered by habit and date, a batch at a time.
+
+        Parameters:
+        batch_size (int): The number of rows fetched from the cursor per batch.
+
+        Yields:
+        list: The next batch of TrackingRecord objects.
+        """
+        cur = self.database.get_cursor()
+        cur.row_factory = tracking_record_factory
+        try:
+            cur.execute('SELECT habit_id, marked_date FROM habit_tracking ORDER BY habit_id, marked_date')
+            while tracking := cur.fetchmany(batch_size):
+                yield tracking
+        finally:
+            cur.close()
@@ -0,0 +1,292 @@
+"""
+Response serialization: a JSON provider backed by orjson when it is installed, and MessagePack
+responses for clients that ask for them with the Accept header.
+
+Both dependencies are optional. Without orjson the provider falls back to the standard json
+module, and without msgpack responses are packed by the pure-Python encoder below.
+"""
+import struct
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+def wants_msgpack():
+    """
+    Check whether the current request prefers MessagePack over JSON.
+
+    Returns:
+    bool: True if the Accept header ranks a MessagePack type above JSON. JSON wins ties and */*.
+    """
+    if not has_request_context():
+        return False
+    best = request.accept_mimetypes.best_match(('application/json',) + MSGPACK_MIMETYPES, default='application/json')
+    return best in MSGPACK_MIMETYPES
+
+def packb(obj, default=None):
+    """
+    Serialize an object as MessagePack, with msgpack if it is installed.
+
+    Parameters:
+    obj: None, bools, ints, floats, strings, bytes, and lists, tuples and dicts of them.
+    default (callable): Converts any other object to one of those types.
+
+    Returns:
+    bytes: The packed object.
+    """
+    if msgpack is not None:
+        return msgpack.packb(obj, default=default)
+    out = bytearray()
+    _pack(obj, out, default)
+    return bytes(out)
+
+def _pack(obj, out, default):
+    """
+    Append the MessagePack encoding of an object to a buffer.
+
+    Parameters:
+    obj: The object.
+    out (bytearray): The buffer.
+    default (callable): Converts unsupported objects, or None to raise TypeError.
+    """
+    kind = type(obj)
+    if obj is None:
+        out.append(0xc0)
+    elif kind is bool:
+        out.append(0xc3 if obj else 0xc2)
+    elif kind is int:
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj >= 0:
+            for marker, fmt, limit in ((0xcc, '>B', 1 << 8), (0xcd, '>H', 1 << 16), (0xce, '>I', 1 << 32), (0xcf, '>Q', 1 << 64)):
+                if obj < limit:
+                    out.append(marker)
+                    out += struct.pack(fmt, obj)
+                    return
+            raise OverflowError('int too large for MessagePack')
+        else:
+            for marker, fmt, limit in ((0xd0, '>b', 1 << 7), (0xd1, '>h', 1 << 15), (0xd2, '>i', 1 << 31), (0xd3, '>q', 1 << 63)):
+                if obj >= -limit:
+                    out.append(marker)
+                    out += struct.pack(fmt, obj)
+                    return
+            raise OverflowError('int too large for MessagePack')
+    elif kind is float:
+        out.append(0xcb)
+        out += struct.pack('>d', obj)
+    elif kind is str:
+        data = obj.encode('utf-8')
+        _pack_header(out, len(data), 0xa0, 32, (0xd9, 0xda, 0xdb))
+        out += data
+    elif kind is bytes or kind is bytearray:
+        _pack_header(out, len(obj), None, 0, (0xc4, 0xc5, 0xc6))
+        out += obj
+    elif kind is list or kind is tuple:
+        _pack_header(out, len(obj), 0x90, 16, (None, 0xdc, 0xdd))
+        # tracking years are long runs of 0/1, which are their own encoding
+        if obj and set(map(type, obj)) == {int}:
+            try:
+                packed = bytes(obj)
+            except ValueError:
+                packed = None
+            if packed is not None and packed.isascii():
+                out += packed
+                return
+        for item in obj:
+            _pack(item, out, default)
+    elif kind is dict:
+        _pack_header(out, len(obj), 0x80, 16, (None, 0xde, 0xdf))
+        for key, value in obj.items():
+            _pack(key, out, default)
+            _pack(value, out, default)
+    elif default is not None:
+        _pack(default(obj), out, None)
+    else:
+        raise TypeError(f'Object of type {kind.__name__} is not MessagePack serializable')
+
+def _pack_header(out, length, fix_marker, fix_limit, markers):
+    """
+    Append the header of a string, binary, array or map.
+
+    Parameters:
+    out (bytearray): The buffer.
+    length (int): The number of bytes or items.
+    fix_marker (int): The marker of the compact "fix" form, or None if the type has none.
+    fix_limit (int): The lengths below which the fix form is used.
+    markers (tuple): The 8, 16 and 32-bit length markers, None where the type has no such form.
+    """
+    if fix_marker is not None and length < fix_limit:
+        out.append(fix_marker | length)
+        return
+    for marker, fmt, limit in zip(markers, ('>B', '>H', '>I'), (1 << 8, 1 << 16, 1 << 32)):
+        if marker is not None and length < limit:
+            out.append(marker)
+            out += struct.pack(fmt, length)
+            return
+    raise OverflowError('object too large for MessagePack')
+
+def unpackb(data):
+    """
+    Deserialize MessagePack, with msgpack if it is installed.
+
+    Parameters:
+    data (bytes): The packed object.
+
+    Returns:
+    The object, with arrays as lists and maps as dicts.
+    """
+    if msgpack is not None:
+        return msgpack.unpackb(data)
+    obj, offset = _unpack(memoryview(data), 0)
+    if offset != len(data):
+        raise ValueError('extra data after MessagePack object')
+    return obj
+
+def _unpack(data, offset):
+    """
+    Decode the MessagePack object at an offset.
+
+    Parameters:
+    data (memoryview): The packed data.
+    offset (int): Where the object starts.
+
+    Returns:
+    tuple: The object and the offset right after it.
+    """
+    marker = data[offset]
+    offset += 1
+    if marker < 0x80:
+        return marker, offset
+    if marker >= 0xe0:
+        return marker - 0x100, offset
+    if 0x80 <= marker <= 0x8f:
+        return _unpack_map(data, offset, marker & 0x0f)
+    if 0x90 <= marker <= 0x9f:
+        return _unpack_array(data, offset, marker & 0x0f)
+    if 0xa0 <= marker <= 0xbf:
+        end = offset + (marker & 0x1f)
+        return str(data[offset:end], 'utf-8'), end
+    if marker in (0xc0, 0xc2, 0xc3):
+        return {0xc0: None, 0xc2: False, 0xc3: True}[marker], offset
+    fixed = {0xca: '>f', 0xcb: '>d', 0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q', 0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'}
+    if marker in fixed:
+        fmt = fixed[marker]
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+    sized = {0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'), 0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+             0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'), 0xde: ('>H', 'map'), 0xdf: ('>I', 'map')}
+    if marker not in sized:
+        raise ValueError(f'unsupported MessagePack marker 0x{marker:02x}')
+    fmt, kind = sized[marker]
+    length = struct.unpack_from(fmt, data, offset)[0]
+    offset += struct.calcsize(fmt)
+    if kind == 'array':
+        return _unpack_array(data, offset, length)
+    if kind == 'map':
+        return _unpack_map(data, offset, length)
+    end = offset + length
+    return (bytes(data[offset:end]) if kind == 'bin' else str(data[offset:end], 'utf-8')), end
+
+def _unpack_array(data, offset, length):
+    """Decode an array of length items starting at offset."""
+    items = []
+    for _ in range(length):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+def _unpack_map(data, offset, length):
+    """Decode a map of length pairs starting at offset."""
+    items = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset)
+        items[key], offset = _unpack(data, offset)
+    return items, offset
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    The app's JSON provider: orjson when installed, and MessagePack when the client asks for it.
+
+    jsonify goes through response(), so every route negotiates without changes. The JSON shape is
+    the same as Flask's; objects orjson would format differently (dates, dataclasses) still go
+    through Flask's default function.
+    Methods:
+        dumps: Serialize data as JSON to a string.
+        loads: Deserialize data from JSON.
+        response: Serialize data as a JSON or MessagePack response.
+    """
+
+    def _orjson_options(self, newline=False):
+        """
+        Get the orjson options matching the provider's settings.
+
+        Parameters:
+        newline (bool): Whether to end the output with a newline.
+
+        Returns:
+        int: The orjson option flags.
+        """
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if newline:
+            options |= orjson.OPT_APPEND_NEWLINE
+        return options
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize data as JSON to a string.
+
+        Parameters:
+        obj: The data to serialize.
+        kwargs: Passed to json.dumps; any given means the standard json module is used.
+
+        Returns:
+        str: The JSON.
+        """
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialize data from JSON.
+
+        Parameters:
+        s (str): Text or UTF-8 bytes.
+        kwargs: Passed to json.loads; any given means the standard json module is used.
+
+        Returns:
+        The data.
+        """
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """
+        Serialize data as a response: MessagePack if the request prefers it, otherwise JSON.
+
+        Returns:
+        Response: The response, with Vary: Accept.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        if wants_msgpack():
+            response = self._app.response_class(packb(obj, default=self.default), mimetype=MSGPACK_MIMETYPES[0])
+        elif orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            response = super().response(obj)
+        else:
+            response = self._app.response_class(orjson.dumps(obj, default=self.default, option=self._orjson_options(newline=True)), mimetype=self.mimetype)
+        response.vary.add('Accept')
+        return response
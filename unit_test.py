@@ -1,7 +1,15 @@
 import pytest
-from app import app
+from app import app, configure_write_behind, create_app, db, enable_async_mode
 import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import base64
+import sqlite3
+import threading
+from db import Database, MIGRATIONS, configure_database, configure_sharding, get_database, set_current_user
+from functions_helper import create_initial_habits
+from records import HabitRecord
+from repository import HabitRepository
+from serialization import packb, unpackb
 
 @pytest.fixture
 def client():
@@ -9,17 +17,40 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture(scope='session')
+def snapshots(tmp_path_factory):
+    """
+    Template databases, built once per test process (so once per worker of a parallel run):
+    'empty' has the current schema, 'initial_habits' also has the predefined habits.
+    """
+    directory = tmp_path_factory.mktemp('snapshots')
+    paths = {name: str(directory / f'{name}.db') for name in ['empty', 'initial_habits']}
+    Database(paths['empty']).close()
+    configure_database(paths['initial_habits'])
+    create_initial_habits()
+    configure_database(None)
+    snapshots = {name: Database(path) for name, path in paths.items()}
+    yield snapshots
+    for snapshot in snapshots.values():
+        snapshot.close()
+
 @pytest.fixture(autouse=True)
-def setup_and_teardown(client):
+def database(snapshots, tmp_path_factory):
     """
-    Setup: Ensure that the habits table is cleared before each test.
-    Teardown: Clear the habits table after each test to maintain isolation.
+    Give every test its own database file, copied from the empty snapshot with the SQLite backup API.
     """
-    # Clear habits table before each test
-    client.post('/clear_habits_table')
-    yield
-    # Clear habits table after each test
-    client.post('/clear_habits_table')
+    path = str(tmp_path_factory.mktemp('db') / 'habits.db')
+    snapshots['empty'].backup(path)
+    configure_database(path)
+    yield get_database()
+    configure_database(None)
+
+@pytest.fixture
+def initial_habits(database, snapshots):
+    """
+    Fill the test's database with the predefined habits, copied from their snapshot.
+    """
+    database.restore(snapshots['initial_habits'])
 
 def test_habit_creation(client):
     """
@@ -98,6 +129,17 @@ def test_habit_name_empty(client):
     assert response.json == {'message': 'Habit name cannot be empty'}
 
 
+def test_habit_lookup_is_exact(client):
+    """
+    Test that habits are looked up by their exact name, ignoring case, and not by substring.
+    """
+    client.post('/habits', json={'name': 'Read Book', 'periodicity': 'W'})
+    assert client.get('/habits/Read').json is None
+    assert client.get('/habits/read book').json[1] == 'Read Book'
+    # cached lookups see the new streak after the habit is marked
+    client.put('/habits/Read Book')
+    assert client.get('/habits/READ BOOK').json[4] == 1
+
 def test_create_initial_habits(client):
     """
     Test that the default habits in the JSON file are actually created
@@ -117,6 +159,20 @@ def test_create_initial_habits(client):
     for habit in response.json:
         assert habit[1] in names_of_habits
 
+def test_create_initial_habits_twice(client):
+    """
+    Test that creating the initial habits again skips the ones that already exist.
+    """
+    client.post('/create_initial_habits')
+    first = client.get('/habits').json
+    response = client.post('/create_initial_habits')
+    assert response.status_code == 200
+    second = client.get('/habits').json
+    assert len(first) == len(second)
+    for habit in first:
+        tracking = client.get(f'/habits/tracking/{habit[0]}').json
+        assert any(1 in days for days in tracking.values())
+
 def test_clear_habits_table(client):
     """
     Test that the habits table can be cleared.
@@ -150,5 +206,631 @@ def test_habit_tracking_data_dimensions(client):
     for key in response.json.keys():
         assert len(response.json[key]) == 365 or len(response.json[key]) == 366
 
+def test_habits_include_status(client):
+    """
+    Test that the habits listing can include the marked status of every habit.
+    """
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    client.post('/habits', json={'name': 'Other Habit', 'periodicity': 'W'})
+    response = client.get('/habits?include_status=true')
+    assert response.status_code == 200
+    assert len(response.json) == 2
+    # both habits were just created, so they were last updated in the current period
+    for habit in response.json:
+        assert habit[6] == 'Same'
+    # the default listing shape is unchanged
+    response = client.get('/habits')
+    assert all(len(habit) == 6 for habit in response.json)
+
+def test_longest_active_streak_start(client):
+    """
+    Test that the longest active streak reports the date its current streak started.
+    """
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    assert client.get('/streaks/longest').json == {'habit': None, 'date': None, 'streak': None}
+    yesterday = (datetime.now().date() - timedelta(days=1)).isoformat()
+    client.post('/habits/completions', json={'completions': [{'name': 'Test Habit', 'dates': [yesterday]}]})
+    client.put('/habits/Test Habit')
+    client.put('/habits/Test Habit')
+    assert client.get('/streaks/longest').json == {'habit': 'Test Habit', 'date': yesterday, 'streak': 2}
+
+def test_streak_summary(client, initial_habits):
+    """
+    Test that the streak summary matches the individual streak endpoints and is refreshed after a write.
+    """
+    summary = client.get('/streaks').json
+    assert summary['daily'] == client.get('/streaks/daily').json
+    assert summary['weekly'] == client.get('/streaks/weekly').json
+    assert summary['monthly'] == client.get('/streaks/monthly').json
+    assert summary['longest'] == client.get('/streaks/longest').json
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    today = datetime.now().date()
+    dates = [(today - timedelta(days=day)).isoformat() for day in range(1, 1000)]
+    client.post('/habits/completions', json={'completions': [{'name': 'Test Habit', 'dates': dates}]})
+    client.put('/habits/Test Habit')
+    summary = client.get('/streaks').json
+    assert summary['daily'] == [['Test Habit', 1000]]
+
+def test_habits_keyset_pagination(client, initial_habits):
+    """
+    Test paging through habits with limit/after, filtering by periodicity and streaming NDJSON.
+    """
+    all_habits = client.get('/habits').json
+    pages, after = [], ''
+    while True:
+        response = client.get(f'/habits?limit=2&after={after}')
+        assert response.status_code == 200
+        pages.extend(response.json)
+        after = response.headers.get('X-Next-After')
+        if after is None:
+            break
+    assert pages == all_habits
+
+    weekly = client.get('/habits?periodicity=W').json
+    assert weekly == [habit for habit in all_habits if habit[2] == 'Weekly']
+
+    response = client.get('/habits?format=ndjson&include_status=true')
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row[:6] for row in rows] == all_habits
+    assert all(len(row) == 7 for row in rows)
+
+    assert client.get('/habits?limit=0').status_code == 400
+
+def test_habit_tracking_date_range(client, initial_habits):
+    """
+    Test that tracking data can be limited to a year or a date range.
+    """
+    habit_id = client.get('/habits').json[0][0]
+    full = client.get(f'/habits/tracking/{habit_id}').json
+    year = sorted(full)[-1]
+    response = client.get(f'/habits/tracking/{habit_id}?year={year}')
+    assert response.status_code == 200
+    assert response.json == {year: full[year]}
+    response = client.get(f'/habits/tracking/{habit_id}?from={year}-01-01&to={year}-12-31')
+    assert response.json == {year: full[year]}
+    assert client.get(f'/habits/tracking/{habit_id}?from=yesterday').status_code == 400
+
+def test_conditional_get(client):
+    """
+    Test that read endpoints answer 304 until the data changes.
+    """
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    for url in ['/habits', '/habits/Test Habit', '/streaks', '/streaks/longest']:
+        response = client.get(url)
+        etag = response.headers['ETag']
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+    client.put('/habits/Test Habit')
+    response = client.get('/habits', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_conditional_get_external_writes_and_dates(client, database, monkeypatch):
+    """
+    Test that versions change after writes by other connections, and at midnight for daily views.
+    """
+    import sys
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    etag = client.get('/habits').headers['ETag']
+    assert client.get('/streaks').json['daily'] == [['Test Habit', 0]]
+    other = Database(database.pool.path)
+    cur = other.get_cursor()
+    # a plain write bumps the version without any call to invalidate_cache
+    cur.execute("UPDATE habits SET streak = 5")
+    other.conn.commit()
+    other.close()
+    response = client.get('/habits', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert client.get('/streaks').json['daily'] == [['Test Habit', 5]]
+
+    class Tomorrow(date):
+        @classmethod
+        def today(cls):
+            return date.fromordinal(date.today().toordinal() + 1)
+    etag = response.headers['ETag']
+    analytics_etag = client.get('/habits/analytics').headers['ETag']
+    monkeypatch.setattr(sys.modules['app'], 'date', Tomorrow)
+    assert client.get('/habits', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/habits/analytics', headers={'If-None-Match': analytics_etag}).status_code == 200
+
+def test_restore_gets_its_own_data_version(database, snapshots):
+    """
+    Test that a restored database does not take over the version of its snapshot.
+    """
+    database.restore(snapshots['initial_habits'])
+    assert database.get_data_version().split('-')[0] != snapshots['initial_habits'].get_data_version().split('-')[0]
+
+def test_metrics(client):
+    """
+    Test that request latency and SQL statement counts are exposed in Prometheus format.
+    """
+    def tracking_query_buckets():
+        text = client.get('/metrics').data.decode()
+        prefix = 'habit_tracker_request_queries_bucket{method="GET",route="/habits/tracking/<string:habit_id>",le="'
+        return {line[len(prefix):].split('"')[0]: int(line.split()[-1]) for line in text.splitlines() if line.startswith(prefix)}
+
+    client.get('/habits/tracking/missing')
+    before = tracking_query_buckets()
+    client.get('/habits/tracking/missing')
+    after = tracking_query_buckets()
+    # reading tracking data is a single query
+    assert after['0'] == before['0']
+    assert after['1'] == before['1'] + 1
+
+    client.post('/habits', json={'name': 'Test Habit', 'periodicity': 'D'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    text = response.data.decode()
+    assert '# TYPE habit_tracker_request_duration_seconds histogram' in text
+    assert 'habit_tracker_request_duration_seconds_count{method="POST",route="/habits",status="200"}' in text
+
+def test_async_mode(client, initial_habits):
+    """
+    Test that the async views return the same data as the sync views.
+    """
+    # async mode is experimental and asgiref is not in requirements.txt
+    pytest.importorskip('asgiref')
+    urls = ['/habits?include_status=true', '/habits?limit=2', '/streaks', '/streaks/daily', '/streaks/longest']
+    habit_id = client.get('/habits').json[0][0]
+    urls += [f'/habits/tracking/{habit_id}', f'/habits/tracking/{habit_id}?format=bitset']
+    expected = {url: client.get(url).json for url in urls}
+    sync_views = dict(app.view_functions)
+    store = enable_async_mode(app, max_workers=2)
+    try:
+        for url in urls:
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.json == expected[url]
+            assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+        assert client.get('/habits?limit=0').status_code == 400
+        assert client.get('/habits?format=ndjson').mimetype == 'application/x-ndjson'
+    finally:
+        app.view_functions.update(sync_views)
+        store.shutdown()
+
+def test_bulk_completions(client):
+    """
+    Test marking many habits on many dates in one request, with streaks recomputed from history.
+    """
+    client.post('/habits', json={'name': 'Daily Habit', 'periodicity': 'D'})
+    client.post('/habits', json={'name': 'Weekly Habit', 'periodicity': 'W'})
+    weekly_id = client.get('/habits/Weekly Habit').json[0]
+    today = datetime.now().date()
+    monday = today - timedelta(days=today.weekday())
+    days_ago = lambda *days: [(today - timedelta(days=day)).isoformat() for day in days]
+    response = client.post('/habits/completions', json={'completions': [
+        # a gap three days ago: only the last three days count
+        {'name': 'Daily Habit', 'dates': days_ago(6, 5, 4, 2, 1, 0)},
+        # two completions in the same week count once
+        {'id': weekly_id, 'dates': [(monday - timedelta(weeks=weeks, days=-day)).isoformat() for weeks, day in [(3, 0), (2, 0), (2, 2), (1, 0)]]},
+    ]})
+    assert response.status_code == 200
+    daily_id = client.get('/habits/Daily Habit').json[0]
+    assert response.json['streaks'] == {daily_id: 3, weekly_id: 3}
+    assert client.get('/habits/Weekly Habit').json[4] == 3
+    assert client.get('/habits/Weekly Habit').json[5] == (monday - timedelta(weeks=1)).isoformat()
+
+    # dates that are already tracked are not inserted again
+    response = client.post('/habits/completions', json={'completions': [{'name': 'Daily Habit', 'dates': days_ago(0, 3)}]})
+    assert list(response.json['streaks'].values()) == [7]
+    # the weekly streak started first
+    assert client.get('/streaks/longest').json == {'habit': 'Weekly Habit', 'date': (monday - timedelta(weeks=3)).isoformat(), 'streak': 3}
+    # marking again today doesn't change the streak, and a backfill long before it doesn't either
+    client.put('/habits/Daily Habit')
+    client.put('/habits/Daily Habit')
+    response = client.post('/habits/completions', json={'completions': [{'name': 'Daily Habit', 'dates': ['2020-01-01']}]})
+    assert list(response.json['streaks'].values()) == [7]
+
+    # a run that ended before the previous period is not a streak
+    client.post('/habits', json={'name': 'Old Habit', 'periodicity': 'D'})
+    response = client.post('/habits/completions', json={'completions': [
+        {'name': 'Old Habit', 'dates': [f'2024-03-{day:02d}' for day in range(1, 11)]},
+    ]})
+    assert list(response.json['streaks'].values()) == [0]
+    habit = client.get('/habits/Old Habit').json
+    assert (habit[4], habit[5]) == (0, '2024-03-10')
+    assert client.get('/streaks/longest').json['habit'] == 'Weekly Habit'
+
+    response = client.post('/habits/completions', json={'completions': [{'name': 'Missing'}]})
+    assert response.status_code == 404
+    assert response.json == {'message': "Habit 'Missing' not found"}
+    assert client.post('/habits/completions', json={'completions': [{'name': ''}]}).json == {'message': "Habit '' not found"}
+    for body in [{'completions': ['Daily Habit']}, {'completions': [{'id': ['x']}]}, {'completions': 'Daily Habit'}, ['Daily Habit']]:
+        assert client.post('/habits/completions', json=body).status_code == 400
+    assert client.post('/habits/completions', json={'completions': [{'name': 'Daily Habit', 'dates': ['soon']}]}).status_code == 400
+
+@pytest.mark.parametrize('format', ['ndjson', 'csv'])
+def test_export_import_round_trip(client, initial_habits, format):
+    """
+    Test that an export can be imported into an empty database and skips existing habits.
+    """
+    habits = client.get('/habits').json
+    tracking = {habit[0]: client.get(f'/habits/tracking/{habit[0]}').json for habit in habits}
+    backup = client.get(f'/export?format={format}').data
+
+    client.post('/clear_habits_table')
+    response = client.post(f'/import?format={format}', data=backup)
+    assert response.status_code == 200
+    assert response.json['habits'] == len(habits)
+    assert response.json['skipped_habits'] == 0
+    assert client.get('/habits').json == habits
+    for habit_id, data in tracking.items():
+        assert client.get(f'/habits/tracking/{habit_id}').json == data
+
+    response = client.post(f'/import?format={format}', data=backup)
+    assert response.json == {'habits': 0, 'tracking': 0, 'skipped_habits': len(habits), 'skipped_tracking': 0}
+
+def test_import_invalid_and_duplicate_records(client):
+    """
+    Test that duplicates within one backup and tracking rows of unknown habits are skipped, and that
+    malformed records are rejected with 400 and the counts of the batches committed before them.
+    """
+    record = {'record': 'habit', 'periodicity': 'D', 'created_at': '2024-01-01', 'streak': 0, 'last_updated_at': '2024-01-01'}
+    lines = [{**record, 'id': 'habit-1', 'name': 'Read'}, {**record, 'id': 'habit-1', 'name': 'Run'},
+             {**record, 'id': 'habit-2', 'name': 'read '}, {**record, 'id': 'habit-3', 'name': 'Swim'}]
+    lines.append({'record': 'tracking', 'id': 'ghost', 'date': '2024-01-02'})
+    response = client.post('/import', data='\n'.join(json.dumps(line) for line in lines))
+    assert response.json == {'habits': 2, 'tracking': 0, 'skipped_habits': 2, 'skipped_tracking': 1}
+    assert [habit[1] for habit in client.get('/habits').json] == ['Read', 'Swim']
+    for body in ['[1, 2]', '"habit"', '{"record": "habit"}', json.dumps({**record, 'id': 'habit-4', 'name': 'Walk', 'periodicity': 'Q'})]:
+        assert client.post('/import', data=body).status_code == 400
+    assert [habit[1] for habit in client.get('/habits').json] == ['Read', 'Swim']
+
+    # a full batch is committed before the malformed record that follows it
+    lines = [{**record, 'id': f'batch-{i}', 'name': f'Batch {i}'} for i in range(1000)] + [{'record': 'habit'}]
+    response = client.post('/import', data='\n'.join(json.dumps(line) for line in lines))
+    assert response.status_code == 400
+    assert response.json['imported'] == {'habits': 1000, 'tracking': 0, 'skipped_habits': 0, 'skipped_tracking': 0}
+    assert len(client.get('/habits').json) == 1002
+
+def test_user_shards(client, tmp_path, monkeypatch):
+    """
+    Test that every user reads and writes their own shard, and that idle shards are closed.
+    """
+    # shards the app got from HABITS_SHARD_DIR would take precedence over these
+    monkeypatch.setattr(app.extensions['habits_databases'], 'shards', None)
+    shards = configure_sharding(str(tmp_path), max_open=1)
+    try:
+        for user in ['alice', 'bob']:
+            response = client.post('/habits', json={'name': f'{user} habit', 'periodicity': 'D'}, headers={'X-User-Id': user})
+            assert response.status_code == 200
+        assert [habit[1] for habit in client.get('/habits', headers={'X-User-Id': 'alice'}).json] == ['Alice Habit']
+        assert list(shards._shards) == ['alice']
+        assert [habit[1] for habit in client.get('/habits', headers={'X-User-Id': 'bob'}).json] == ['Bob Habit']
+        assert client.get('/habits').json == []
+        assert sorted(path.name for path in tmp_path.glob('*.db')) == ['alice.db', 'bob.db']
+        assert client.get('/habits', headers={'X-User-Id': '../habits'}).status_code == 400
+    finally:
+        configure_sharding(None)
+
+def test_user_shards_stay_open_while_in_use(client, tmp_path, monkeypatch):
+    """
+    Test that an evicted shard is closed only once the context using it lets it go.
+    """
+    # shards the app got from HABITS_SHARD_DIR would take precedence over these
+    monkeypatch.setattr(app.extensions['habits_databases'], 'shards', None)
+    shards = configure_sharding(str(tmp_path), max_open=1)
+    try:
+        for name in ['Read', 'Run', 'Swim']:
+            client.post('/habits', json={'name': name, 'periodicity': 'D'}, headers={'X-User-Id': 'alice'})
+        started, evicted = threading.Event(), threading.Event()
+        names = []
+
+        def stream_alice():
+            set_current_user('alice')
+            try:
+                for batch in HabitRepository(db).iter_habit_batches(batch_size=1):
+                    started.set()
+                    evicted.wait()
+                    names.extend(habit.name for habit in batch)
+            finally:
+                set_current_user(None)
+
+        thread = threading.Thread(target=stream_alice)
+        thread.start()
+        started.wait()
+        assert client.get('/habits', headers={'X-User-Id': 'bob'}).json == []
+        assert list(shards._shards) == ['bob']
+        evicted.set()
+        thread.join()
+        assert sorted(names) == ['Read', 'Run', 'Swim']
+        assert shards._evicted == set() and shards._leases == {}
+    finally:
+        configure_sharding(None)
+
+@pytest.mark.parametrize('durability', ['immediate', 'grouped'])
+def test_write_behind_completions(client, durability, monkeypatch):
+    """
+    Test that queued completions are committed in one group, seen by the next read, and counted
+    like direct completions.
+    """
+    # a writer the app got from HABITS_WRITE_BEHIND would take precedence over this one
+    monkeypatch.delitem(app.extensions, 'habits_completion_writer', raising=False)
+    writer = configure_write_behind(durability, max_delay=0.5)
+    try:
+        client.post('/habits', json={'name': 'Brush Teeth', 'periodicity': 'D'})
+        client.post('/habits', json={'name': 'Read', 'periodicity': 'D'})
+        if durability == 'immediate':
+            threads = [threading.Thread(target=app.test_client().put, args=(f'/habits/{name}',)) for name in ['Brush Teeth', 'Read']]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            assert client.put('/habits/Brush Teeth').status_code == 200
+            assert client.put('/habits/Read').status_code == 200
+            assert writer._submitted - writer._written == 2
+        assert [habit[4] for habit in client.get('/habits').json] == [1, 1]
+        assert writer._submitted == writer._written
+        # a second completion on the same day counts the same as without write-behind: not at all
+        client.put('/habits/Read')
+        assert client.get('/habits/Read').json[4] == 1
+        assert client.put('/habits/Missing').status_code == 404
+    finally:
+        configure_write_behind(None)
+
+def test_habit_analytics(client):
+    """
+    Test the analytics of a habit and of all habits, and that a completion refreshes them.
+    """
+    today = datetime.now().date()
+    client.post('/habits', json={'name': 'Read', 'periodicity': 'D'})
+    client.post('/habits', json={'name': 'Run', 'periodicity': 'W'})
+    habits = {habit[1]: habit[0] for habit in client.get('/habits').json}
+    assert client.get('/habits/Read/analytics').json == {
+        'completion_rate': 0.0, 'rolling_30_days': 0.0, 'rolling_90_days': 0.0, 'weekdays': [0] * 7, 'months': []
+    }
+    assert client.get('/habits/Missing/analytics').status_code == 404
+
+    client.post('/habits/completions', json={'completions': [
+        {'id': habits['Read'], 'dates': [today.isoformat()]},
+        {'id': habits['Run'], 'dates': [today.isoformat()]},
+    ]})
+    analytics = client.get('/habits/Read/analytics').json
+    assert analytics['completion_rate'] == 1.0
+    assert analytics['rolling_30_days'] == 1.0
+    assert analytics['weekdays'][today.weekday()] == 1
+    assert analytics['months'] == [{'month': today.strftime('%Y-%m'), 'completions': 1}]
+
+    yesterday = today - timedelta(days=1)
+    client.post('/habits/completions', json={'completions': [{'id': habits['Read'], 'dates': [yesterday.isoformat()]}]})
+    assert client.get('/habits/Read/analytics').json['weekdays'][yesterday.weekday()] == 1
+    everything = client.get('/habits/analytics').json
+    assert everything['completion_rate'] == 1.0
+    assert sum(everything['weekdays']) == 3
+
+    # backfilled completions before the creation count towards the rates as well as the histograms
+    client.post('/habits', json={'name': 'Old', 'periodicity': 'D'})
+    client.post('/habits/completions', json={'completions': [
+        {'name': 'Old', 'dates': [f'2024-03-{day:02}' for day in range(1, 11)]},
+    ]})
+    analytics = client.get('/habits/Old/analytics').json
+    assert analytics['completion_rate'] == round(10 / ((today - date(2024, 3, 1)).days + 1), 4)
+    assert analytics['rolling_30_days'] == 0.0
+    assert analytics['months'] == [{'month': '2024-03', 'completions': 10}]
+
+def test_daily_rollup(client):
+    """
+    Test that the daily rollup follows completions, deletions and imports, and matches a rebuild.
+    """
+    client.post('/habits', json={'name': 'Read', 'periodicity': 'D'})
+    client.post('/habits', json={'name': 'Run', 'periodicity': 'W'})
+    habits = {habit[1]: habit[0] for habit in client.get('/habits').json}
+    client.post('/habits/completions', json={'completions': [
+        {'id': habits['Read'], 'dates': ['2024-03-01', '2024-03-02']},
+        {'id': habits['Run'], 'dates': ['2024-03-01']},
+    ]})
+    # marking a habit again on the same day adds no second completion
+    client.put('/habits/Run')
+    client.put('/habits/Run')
+    today = datetime.now().date().isoformat()
+    assert client.get('/rollup').json == [
+        ['2024-03-01', 'D', 1, 1], ['2024-03-01', 'W', 1, 1], ['2024-03-02', 'D', 1, 1], [today, 'W', 1, 1],
+    ]
+    assert client.get('/rollup?periodicity=D&from=2024-03-02').json == [['2024-03-02', 'D', 1, 1]]
+    # the last column counts the habits active that day, completed or not
+    client.post('/habits', json={'name': 'Walk', 'periodicity': 'D'})
+    client.post('/habits/completions', json={'completions': [{'name': 'Walk', 'dates': ['2024-03-02']}]})
+    client.delete('/habits/Walk')
+    client.post('/habits', json={'name': 'Swim', 'periodicity': 'D'})
+    client.post('/habits/completions', json={'completions': [{'name': 'Swim', 'dates': ['2024-02-01']}]})
+    assert client.get('/rollup?periodicity=D').json == [
+        ['2024-02-01', 'D', 1, 1], ['2024-03-01', 'D', 1, 2], ['2024-03-02', 'D', 1, 3],
+    ]
+    # deleted habits still count for the days they were active
+    client.delete('/habits/Swim')
+    client.delete('/habits/Run')
+    assert client.get('/rollup').json == [['2024-03-01', 'D', 1, 2], ['2024-03-02', 'D', 1, 3]]
+
+    backup = client.get('/export').data
+    client.post('/clear_habits_table')
+    client.post('/import', data=backup)
+    rollup = client.get('/rollup').json
+    assert rollup == [['2024-03-01', 'D', 1, 1], ['2024-03-02', 'D', 1, 1]]
+    assert db.rebuild_daily_rollup() == 2
+    assert client.get('/rollup').json == rollup
+    assert app.test_cli_runner().invoke(args=['rebuild-rollup']).output == 'Rebuilt the daily rollup: 2 rows\n'
+
+def test_create_app_opens_database_lazily(client, tmp_path):
+    """
+    Test that an app made by the factory only opens its database on first use, and that every app
+    keeps its own database.
+    """
+    paths = [tmp_path / 'first.db', tmp_path / 'second.db']
+    first = create_app(str(paths[0])).test_client()
+    second = create_app(str(paths[1])).test_client()
+    assert not any(path.exists() for path in paths)
+    assert first.post('/habits', json={'name': 'Read', 'periodicity': 'D'}).status_code == 200
+    assert paths[0].exists() and not paths[1].exists()
+    assert second.post('/habits', json={'name': 'Run', 'periodicity': 'D'}).status_code == 200
+    assert [habit[1] for habit in first.get('/habits').json] == ['Read']
+    assert [habit[1] for habit in second.get('/habits').json] == ['Run']
+    assert client.get('/habits').json == []
+    for app_client in [first, second]:
+        app_client.application.extensions['habits_databases'].close()
+
+def test_habit_repository_records(client, initial_habits):
+    """
+    Test that the repository hydrates slotted records that serialize to the API's JSON shape.
+    """
+    repository = HabitRepository()
+    habits = repository.get_habits()
+    assert all(type(habit) is HabitRecord and not hasattr(habit, '__dict__') for habit in habits)
+    assert [habit.to_json() for habit in habits] == client.get('/habits').json
+    assert repository.get_habit(habits[0].name.upper()).to_json() == client.get(f'/habits/{habits[0].name}').json
+    assert repository.get_habit('Missing') is None
+    tracking = [row for batch in repository.iter_tracking(batch_size=10) for row in batch]
+    assert len(tracking) == db.conn.execute('SELECT COUNT(*) FROM habit_tracking').fetchone()[0]
+    assert [(row.habit_id, row.marked_date) for row in tracking] == sorted((row.habit_id, row.marked_date) for row in tracking)
+
+def test_msgpack_negotiation(client, initial_habits):
+    """
+    Test that clients asking for MessagePack get the same data, smaller and with its own ETag.
+    """
+    habit_id = client.get('/habits').json[0][0]
+    for url in ['/habits?include_status=true', f'/habits/tracking/{habit_id}', '/streaks']:
+        expected = client.get(url)
+        response = client.get(url, headers={'Accept': 'application/msgpack'})
+        assert response.mimetype == 'application/msgpack'
+        # MessagePack keeps the integer year keys that JSON turns into strings
+        assert json.loads(json.dumps(unpackb(response.data))) == expected.json
+        assert len(response.data) < len(expected.data)
+        assert response.headers['ETag'] != expected.headers['ETag']
+        assert client.get(url, headers={'Accept': 'application/msgpack', 'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/streaks', headers={'Accept': '*/*'}).mimetype == 'application/json'
+    values = [None, True, False, -1, -200, 1.5, 2 ** 40, -2 ** 40, 'é' * 40, 'x' * 70000, b'bytes', {'key': list(range(300))}]
+    assert unpackb(packb(values)) == values
+
+def create_legacy_database(path):
+    """
+    Create a database in the layout used before schema versioning, with one habit.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE habits (id UUID, name TEXT, periodicity TEXT, created_at TEXT, streak INTEGER, last_updated_at DATE, PRIMARY KEY (id))')
+    conn.execute('CREATE TABLE habit_tracking (habit_id UUID, marked_date DATE)')
+    conn.execute("INSERT INTO habits VALUES ('habit-1', 'Read', 'D', '2024-01-01T00:00:00', 2, '2024-01-03T00:00:00')")
+    conn.executemany('INSERT INTO habit_tracking VALUES (?, ?)', [('habit-1', f'2024-01-0{day}T00:00:00') for day in (1, 2, 3)])
+    conn.commit()
+    conn.close()
+
+def test_schema_migration_upgrades_existing_database(tmp_path):
+    """
+    Test that a database created before schema versioning is upgraded in place.
+    """
+    path = str(tmp_path / 'legacy.db')
+    create_legacy_database(path)
+
+    database = Database(path)
+    assert database.get_schema_version() == MIGRATIONS[-1][0]
+    assert database.habit_exists('Read')
+    cur = database.get_cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ('habits', 'habit_tracking')")
+    indexes = {row[0] for row in cur.fetchall()}
+    cur.close()
+    assert {'idx_habit_tracking_habit_date', 'idx_habits_name', 'idx_habits_periodicity_streak'} <= indexes
+    # the start of the current streak is backfilled from the tracking history
+    assert database.get_longest_active_streak() == ('Read', '2024-01-02', 2)
+    assert database.get_habit_by_name(' read ')[0] == 'habit-1'
+    # dates are stored as integer day ordinals
+    cur = database.get_cursor()
+    cur.execute('SELECT created_at, last_updated_at FROM habits')
+    assert cur.fetchone() == (datetime(2024, 1, 1).toordinal(), datetime(2024, 1, 3).toordinal())
+    cur.execute('SELECT DISTINCT typeof(marked_date) FROM habit_tracking')
+    assert cur.fetchall() == [('integer',)]
+    cur.close()
+    # running the migrations again is a no-op
+    assert database.migrate() == MIGRATIONS[-1][0]
+    database.close()
+
+def test_schema_migration_renames_duplicate_names(tmp_path):
+    """
+    Test that names differing only in case or surrounding whitespace are made unique when upgrading.
+    """
+    path = str(tmp_path / 'legacy.db')
+    create_legacy_database(path)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO habits VALUES (?, ?, ?, ?, ?, ?)', [
+        ('habit-2', 'Read ', 'D', '2024-01-02T00:00:00', 0, '2024-01-02T00:00:00'),
+        ('habit-3', 'READ', 'D', '2024-01-03T00:00:00', 0, '2024-01-03T00:00:00'),
+        ('habit-4', 'read (2)', 'D', '2024-01-04T00:00:00', 0, '2024-01-04T00:00:00'),
+    ])
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    assert [database.get_habit_by_name(name)[0] for name in ['read', 'Read (2)', 'read (3)', 'Read (4)']] == \
+        ['habit-1', 'habit-4', 'habit-2', 'habit-3']
+    database.close()
+
+def test_schema_migration_concurrent_openers(tmp_path):
+    """
+    Test that connections opening the same old database at once apply every migration once.
+    """
+    for run in range(5):
+        path = str(tmp_path / f'legacy-{run}.db')
+        create_legacy_database(path)
+        barrier = threading.Barrier(4)
+        errors = []
+
+        def open_database():
+            barrier.wait()
+            try:
+                Database(path).close()
+            except sqlite3.Error as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=open_database) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        database = Database(path)
+        cur = database.get_cursor()
+        cur.execute('SELECT version, COUNT(*) FROM schema_version GROUP BY version HAVING COUNT(*) > 1')
+        assert cur.fetchall() == []
+        cur.close()
+        assert database.get_habit_by_name('read')[0] == 'habit-1'
+        database.close()
+
+def test_connection_pool_per_thread(tmp_path):
+    """
+    Test that every thread gets its own WAL-mode connection and finished threads' connections are reused.
+    """
+    database = Database(str(tmp_path / 'pool.db'))
+    main_conn = database.conn
+    assert main_conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    seen = []
+
+    def worker():
+        seen.append(database.conn)
+        assert database.habit_exists('Missing') is False
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen[0] is not main_conn
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert seen[1] is seen[0]
+    database.close()
+
+def test_habit_tracking_bitset_format(client, initial_habits):
+    """
+    Test that the compact bitset format decodes to the same tracking data as the default format.
+    """
+    for habit in client.get('/habits').json:
+        expected = client.get(f'/habits/tracking/{habit[0]}').json
+        response = client.get(f'/habits/tracking/{habit[0]}?format=bitset')
+        assert response.status_code == 200
+        assert response.json.keys() == expected.keys()
+        for year, bits in response.json.items():
+            packed = base64.b64decode(bits)
+            days = [(packed[i // 8] >> (7 - i % 8)) & 1 for i in range(len(expected[year]))]
+            assert days == expected[year]
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from db import get_app_databases, get_current_user, set_current_user, use_app_databases
+from habit import Habit
+
+DURABILITY_LEVELS = ('immediate', 'grouped')
+
+class CompletionWriter:
+    """
+    A write-behind queue that commits habit completions in grouped transactions.
+
+    A background thread collects completions until max_batch are queued or max_delay has passed
+    since the first one, then writes each user's completions in a single transaction, so many
+    completions share one commit (and one fsync). With 'immediate' durability, submit waits
+    until the completion is committed; with 'grouped' durability it returns right away, and
+    completions still queued are lost if the process dies.
+    Methods:
+        submit: Queue a completion.
+        flush: Wait until the completions queued so far are committed.
+        close: Commit the queued completions and stop the writer thread.
+    """
+
+    def __init__(self, durability='immediate', max_batch=256, max_delay=0.01):
+        """
+        Initialize the writer and start its thread.
+
+        Parameters:
+        durability (str): 'immediate' to wait for the commit in submit, 'grouped' to return once queued.
+        max_batch (int): The maximum number of completions written per flush.
+        max_delay (float): The longest a completion waits for others to join its flush, in seconds.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'Invalid durability: {durability!r}')
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._submitted = 0
+        self._written = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='habits-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, habit_id, day):
+        """
+        Queue a completion of a habit for the current user.
+
+        Parameters:
+        habit_id (str): The ID of the habit.
+        day (date): The day the habit was completed.
+        """
+        future = Future()
+        # numbered and queued under the lock, so items are written in the order of their numbers
+        with self._condition:
+            self._submitted += 1
+            self._queue.put(((get_app_databases(), get_current_user()), habit_id, day, future))
+        if self.durability == 'immediate':
+            future.result()
+
+    def flush(self):
+        """
+        Wait until the completions queued before the call are committed, so reads see them.
+
+        Completions queued while waiting are not waited for, so steady writes cannot hold up a read.
+        """
+        with self._condition:
+            target = self._submitted
+            while self._written < target:
+                self._condition.wait()
+
+    def close(self):
+        """Commit the queued completions and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        """Collect and write batches of completions until closed."""
+        closed = False
+        while not closed:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        """
+        Write a batch of completions, one transaction per user.
+
+        Parameters:
+        batch (list): The queued ((app databases, user), habit ID, day, future) tuples.
+        """
+        users = {}
+        for user, habit_id, day, future in batch:
+            completions, futures = users.setdefault(user, ([], []))
+            completions.append((habit_id, day))
+            futures.append(future)
+        for (databases, user), (completions, futures) in users.items():
+            try:
+                use_app_databases(databases)
+                set_current_user(user)
+                Habit().record_completions(completions)
+            except Exception as e:
+                print(f'Failed to write {len(futures)} completions: {e}')
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(None)
+        # release the last user's shard, so it can be closed once evicted
+        set_current_user(None)
+        use_app_databases(None)
+        with self._condition:
+            self._written += len(batch)
+            self._condition.notify_all()